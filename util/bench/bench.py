@@ -0,0 +1,199 @@
+import os
+import sys
+import gzip
+import json
+import time
+import resource
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from importlib.metadata import version as version_of
+
+HERE = Path(__file__).resolve().parent
+
+# Docs approximating what json-docs.nk outputs, made from the doc
+# strings in env/ and src/ rather than captured. `make bench-fixture`
+# replaces them with a real capture.
+FIXTURE = HERE / 'novika-docs.ndjson'
+
+SIZES = (1000, 10000, 100000)
+
+# Peak RSS, in MiB, that runs on synthetic corpora of the given
+# sizes must stay under (see `check_rss`).
+MAX_RSS_MIB = {100000: 1024}
+
+
+def run(path, streamed=False):
+  """
+  Build the payload for the corpus at `path` in this process,
+  and return how long it took, in total, in each part of the run
+  (see `nkdoc.TIMING`) and in each stage (see `nkdoc.STATS`), and
+  peak RSS. If `streamed` is true, words are read the way nkdoc.py
+  reads them, i.e. rewritten as they arrive (see `nkdoc.stream`).
+  """
+  sys.path.insert(0, str(HERE.parent))
+  import nkdoc
+  start = time.perf_counter()
+  with nkdoc.TIMING('read input'), open(path) as lines:
+    if streamed:
+      words, rewritten = nkdoc.read_words(lines)
+    else:
+      words, rewritten = {obj["name"]: obj for obj in nkdoc.records(lines)}, None
+  with nkdoc.TIMING('build'):
+    payload, _ = nkdoc.build(words, rewritten=rewritten)
+  with nkdoc.TIMING('write output'):
+    nkdoc.encode_payload(payload)
+  wall = time.perf_counter() - start
+  cpu = time.process_time()
+  # On Linux, ru_maxrss is in KiB.
+  peak_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return {
+    "words": len(words),
+    "wall": wall,
+    "cpu": cpu,
+    "spans": nkdoc.TIMING.spans,
+    "stages": nkdoc.STATS.stages,
+    "formats": {format: measure_format(nkdoc, payload, format) for format in ('json', 'columnar')},
+    "peak_rss_kib": peak_rss_kib,
+  }
+
+
+def measure_format(nkdoc, payload, format):
+  """
+  Return the size of `payload` in the given `format`, raw and
+  compressed, and how long it takes to parse.
+  """
+  data = nkdoc.encode_payload(payload, format).encode()
+  start = time.perf_counter()
+  json.loads(data)
+  parse = time.perf_counter() - start
+  try:
+    import brotli
+    brotli_bytes = len(brotli.compress(data))
+  except ImportError:
+    brotli_bytes = None
+  return {
+    "bytes": len(data),
+    "gzip_bytes": len(gzip.compress(data, 9)),
+    "brotli_bytes": brotli_bytes,
+    "parse": parse,
+  }
+
+
+def measure(name, path, streamed=False):
+  """
+  Run the benchmark for the corpus at `path` in a fresh process,
+  streaming it if `streamed` is true (see `run`).
+  """
+  if streamed:
+    name = f'{name}, streamed'
+  print(f'[INFO] Benchmarking {name}', file=sys.stderr)
+  env = dict(os.environ, PYTHONHASHSEED='0')
+  result = subprocess.run(
+    [sys.executable, __file__, '--run', str(path), *(['--streamed'] if streamed else [])],
+    env=env, check=True, stdout=subprocess.PIPE, text=True
+  )
+  return { "corpus": name, "streamed": streamed, **json.loads(result.stdout) }
+
+
+def check_rss(runs):
+  """
+  Return how `runs` on synthetic corpora did against `MAX_RSS_MIB`,
+  warning about those that went over.
+  """
+  checks = []
+  for run in runs:
+    size = run.get("size")
+    if size not in MAX_RSS_MIB:
+      continue
+    peak = run["peak_rss_kib"] / 1024
+    ok = peak <= MAX_RSS_MIB[size]
+    if not ok:
+      print(f'[WARN] Peak RSS of {run["corpus"]} is {peak:.0f} MiB, over {MAX_RSS_MIB[size]} MiB', file=sys.stderr)
+    checks.append({ "corpus": run["corpus"], "peak_rss_mib": peak, "max_rss_mib": MAX_RSS_MIB[size], "ok": ok })
+  return checks
+
+
+def versions():
+  """Return versions of things that affect the results."""
+  try:
+    commit = subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], cwd=HERE, check=True,
+      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {
+    "commit": commit,
+    "python": platform.python_version(),
+    "nltk": version_of('nltk'),
+    "numpy": version_of('numpy'),
+    "mistune": version_of('mistune'),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Benchmark nkdoc.py on the Novika docs fixture and on synthetic corpora, and print results as JSON. Fails if peak RSS of a synthetic corpus goes over its target.'
+  )
+  parser.add_argument(
+    '--sizes', type=int, nargs='*', default=SIZES, metavar='N',
+    help='sizes of synthetic corpora, in words (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--no-fixture', action='store_true',
+    help=f'do not benchmark the docs in {FIXTURE.name}'
+  )
+  parser.add_argument(
+    '--no-streamed', action='store_true',
+    help='do not also benchmark reading corpora the way nkdoc.py does, rewriting words as they arrive'
+  )
+  parser.add_argument(
+    '--output', metavar='FILE',
+    help='write results to FILE instead of STDOUT'
+  )
+  parser.add_argument('--run', metavar='CORPUS', help=argparse.SUPPRESS)
+  parser.add_argument('--streamed', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run:
+    print(json.dumps(run(args.run, args.streamed)))
+    return
+
+  modes = [False] if args.no_streamed else [False, True]
+
+  sys.path.insert(0, str(HERE))
+  import corpus
+
+  runs = []
+  if not args.no_fixture:
+    for streamed in modes:
+      runs.append(measure(FIXTURE.stem, FIXTURE, streamed))
+  with tempfile.TemporaryDirectory() as directory:
+    for size in args.sizes:
+      path = Path(directory) / f'synthetic-{size}.ndjson'
+      with open(path, 'w') as file:
+        for word in corpus.generate(size):
+          print(json.dumps(word), file=file)
+      for streamed in modes:
+        runs.append({ **measure(f'synthetic-{size}', path, streamed), "size": size })
+
+  results = {
+    "date": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    "versions": versions(),
+    "runs": runs,
+    "rss": check_rss(runs),
+  }
+  if args.output:
+    with open(args.output, 'w') as file:
+      json.dump(results, file, indent=2)
+  else:
+    print(json.dumps(results, indent=2))
+  if not all(check["ok"] for check in results["rss"]):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
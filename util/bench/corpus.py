@@ -0,0 +1,110 @@
+import sys
+import json
+import random
+import argparse
+
+# Things words take and leave. Some share their short names on
+# purpose (Block, Boolean, Byteslice), as they do in Novika's own
+# docs, so that nkdoc has collisions to resolve.
+THINGS = (
+  'Block', 'Boolean', 'Byteslice', 'Quote', 'Quotient', 'Form', 'Decimal',
+  'Index', 'Length', 'Name', 'Word', 'Entry', 'Value', 'Color', 'Pointer',
+  'Struct layout', 'Struct layout form', 'Layout block', 'Zipped block',
+  'Block of quotes', 'Byte count', 'Result', 'Stack', 'Opener', 'Hook',
+  'Foreign function', 'Message', 'Delimiter', 'Separator', 'Capability',
+  'Amount', 'Count', 'Default', 'Predicate', 'Key', 'Object', 'Path',
+)
+
+VERBS = (
+  'leaves', 'pushes', 'drops', 'parses', 'converts', 'eases', 'appends',
+  'prepends', 'slices', 'joins', 'splits', 'hydrates', 'opens', 'evaluates',
+  'reverses', 'sorts', 'filters', 'maps', 'zips', 'fetches', 'submits',
+)
+
+NAME_VERBS = (
+  'append', 'prepend', 'slice', 'join', 'split', 'hydrate', 'open', 'sort',
+  'filter', 'map', 'zip', 'fetch', 'submit', 'gulp', 'spit', 'cherry',
+  'shove', 'tuck', 'reverse', 'count', 'ease', 'parse', 'convert', 'as',
+)
+
+NAME_NOUNS = (
+  'Block', 'Quote', 'Echo', 'Entry', 'Stack', 'Form', 'Decimal', 'Color',
+  'Layout', 'Struct', 'Bytes', 'Index', 'Word', 'Hook', 'Opener', 'Path',
+)
+
+FILLER = (
+  'Dies if there is a different amount of forms in {a} and {b}.',
+  'This is useful when {a} is not known in advance.',
+  '{a} is left unchanged, and the result is a new {b}.',
+  'Note that {a} is not copied, so be careful.',
+  'If {a} is empty, leaves {b} as is.',
+)
+
+
+def short(thing):
+  """Return the short name of `thing`, as in effects."""
+  return ''.join(word[0] for word in thing.split())
+
+
+def generate(n, seed=0):
+  """
+  Generate `n` word JSON objects, the way json-docs.nk outputs
+  them. The result only depends on `n` and `seed`.
+  """
+  rng = random.Random(seed)
+  names = []
+  seen = set()
+  while len(names) < n:
+    name = rng.choice(NAME_VERBS) + rng.choice(NAME_NOUNS)
+    if rng.random() < 0.3:
+      name += rng.choice(NAME_NOUNS)
+    if rng.random() < 0.2:
+      name += ':'
+    if name in seen:
+      name += str(len(names))
+    seen.add(name)
+    names.append(name)
+  words = []
+  for index, name in enumerate(names):
+    takes = rng.sample(THINGS, rng.randint(0, 3))
+    leaves = rng.sample(THINGS, rng.randint(0, 2))
+    effect = ' '.join([*map(short, takes), '--', *map(short, leaves)])
+    sentences = []
+    if takes or leaves:
+      verb = rng.choice(VERBS)
+      mentioned = ', '.join(takes) or 'nothing'
+      sentences.append(f'{verb} {mentioned}, and leaves {" and ".join(leaves) or "nothing"}.')
+    else:
+      sentences.append(f'{rng.choice(VERBS)} the active stack.')
+    # Outbound refs mostly point nearby, as related words tend to be
+    # defined close to each other.
+    if rng.random() < 0.3:
+      other = names[max(0, min(n - 1, index + rng.randint(-20, 20)))]
+      sentences.append(f'Same as `{other}`, but for {rng.choice(THINGS)}.')
+    for _ in range(rng.randint(0, 3)):
+      a, b = rng.sample(THINGS, 2)
+      sentences.append(rng.choice(FILLER).format(a=a, b=b))
+    if rng.random() < 0.4:
+      other = names[rng.randrange(n)]
+      sentences.append(f'See `{other}`.')
+    desc = f'( {effect} ): ' + ' '.join(sentences)
+    if rng.random() < 0.3:
+      desc += f'\n\n```\n[ 1 2 3 ] {name} leaves: [ 3 2 1 ]\n```\n'
+    words.append({ "name": name, "desc": desc })
+  return words
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Print a synthetic corpus of Novika word documentation to STDOUT, one word JSON object per line (as json-docs.nk does).'
+  )
+  parser.add_argument('words', type=int, help='number of words to generate')
+  parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+  args = parser.parse_args()
+
+  for word in generate(args.words, args.seed):
+    print(json.dumps(word), file=sys.stdout)
+
+
+if __name__ == '__main__':
+  main()
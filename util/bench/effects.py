@@ -0,0 +1,164 @@
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+import nkdoc
+import corpus
+from bench import FIXTURE
+
+# The regexes nkdoc used to split effects with, before `find_effect`
+# and `split_effect`.
+RE_EFFECT_B = re.compile(r'^\(')
+RE_EFFECT_E = re.compile(r'\)(?:[^)]*?:|\s*$)')
+RE_TAKES = re.compile(r'\((.*?)\s+--(?:\s+|$)')
+
+# Characters fuzzed descriptions are made of. Includes whitespace
+# other than ' ' and '\n', which `\s` and `str.isspace` must agree on.
+ALPHABET = '(()):---  \n\t\x1c BQx'
+
+# Worst cases, by name, for descriptions of size about `n`.
+WORST_CASES = {
+  'whitespace before takes': lambda n: '( ' + ' ' * n + 'x ): foo',
+  'nested takes': lambda n: '( -- ' * (n // 5) + '): foo',
+  'nested takes on lines': lambda n: '( --\n' * (n // 5) + '): foo',
+  'nested takes, long leaves': lambda n: '( -- ' * (n // 10) + 'x' * (n // 2) + ' ): foo',
+  'closing brackets': lambda n: '(' + ' )' * (n // 2),
+  'colons after brackets': lambda n: '( x' + ' ) y' * (n // 4) + ' :',
+}
+
+
+def split_by_regex(desc):
+  """
+  Split `desc` into effect, takes, leaves and markdown the way
+  `GameteWord` did with regexes.
+  """
+  b = RE_EFFECT_B.match(desc)
+  e = RE_EFFECT_E.search(desc)
+  effectish = None
+  if b and e:
+    effect = desc[b.start():e.start() - 1]
+    markdown = desc[e.end():]
+    if mdb := nkdoc.RE_MARKDOWN_B.search(markdown):
+      effectish = desc[b.start():e.end() + mdb.start() - 1]
+      markdown = markdown[mdb.start():]
+  else:
+    effect = ''
+    markdown = desc
+  effectish = effect if effectish is None else effectish
+  takes = ''
+  if leaves := effect:
+    while match := RE_TAKES.match(leaves):
+      takes += match.group(1)
+      leaves = leaves[:match.start()] + leaves[match.end():]
+  return effectish, takes, leaves, markdown
+
+
+def split_by_scanner(desc):
+  """Same as `split_by_regex`, but with `find_effect` and `split_effect`."""
+  effectish = None
+  if found := nkdoc.find_effect(desc):
+    close, end = found
+    effect = desc[:close - 1]
+    markdown = desc[end:]
+    if mdb := nkdoc.RE_MARKDOWN_B.search(markdown):
+      effectish = desc[:end + mdb.start() - 1]
+      markdown = markdown[mdb.start():]
+  else:
+    effect = ''
+    markdown = desc
+  effectish = effect if effectish is None else effectish
+  spans, leaves = nkdoc.split_effect(effect)
+  return effectish, ''.join(effect[begin:end] for begin, end in spans), effect[leaves:], markdown
+
+
+def split_by_gamete(desc):
+  """Same as `split_by_regex`, but with `GameteWord` as it is now."""
+  zygote = nkdoc.GameteWord('', nkdoc.WordDescView(desc)).rewrite(None)
+  return zygote.effect, str(zygote.takes), str(zygote.leaves), zygote.markdown
+
+
+def check(descs):
+  """
+  Return descriptions among `descs` that `GameteWord` splits
+  differently than the regexes did.
+  """
+  return [desc for desc in descs if split_by_regex(desc) != split_by_gamete(desc)]
+
+
+def fuzz(count, seed=0):
+  """Yield `count` random descriptions, some with effect-like prefixes."""
+  rng = random.Random(seed)
+  for _ in range(count):
+    desc = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+    yield desc if rng.random() < 0.2 else '(' + desc
+
+
+def timed(split, desc):
+  """Return how long `split` takes to split `desc`, at best of a few."""
+  best = None
+  for _ in range(3):
+    start = time.perf_counter()
+    split(desc)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Check that nkdoc.py splits effects the way its old regexes did, on fixture and synthetic docs and on fuzzed descriptions, and time both on worst cases. Print results as JSON.'
+  )
+  parser.add_argument(
+    '--fuzz', type=int, default=200000, metavar='N',
+    help='number of fuzzed descriptions to check (default: %(default)s)'
+  )
+  parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+  parser.add_argument(
+    '--regex-max-size', type=int, default=16000, metavar='N',
+    help='only time the old regexes on worst cases of up to N characters, as they take minutes on larger ones (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--sizes', type=int, nargs='*', default=(1000, 4000, 16000, 64000, 256000, 1024000), metavar='N',
+    help='sizes of worst case descriptions, in characters (default: %(default)s)'
+  )
+  args = parser.parse_args()
+
+  with open(FIXTURE) as lines:
+    fixture = [obj["desc"] for obj in nkdoc.records(lines)]
+  synthetic = [obj["desc"] for obj in corpus.generate(10000, args.seed)]
+  mismatches = {
+    "fixture": check(fixture),
+    "synthetic": check(synthetic),
+    "fuzzed": check(fuzz(args.fuzz, args.seed)),
+  }
+  for name, descs in mismatches.items():
+    status = 'OK' if not descs else f'{len(descs)} mismatches'
+    print(f'[INFO] Effects of {name} docs: {status}', file=sys.stderr)
+
+  worst_cases = {}
+  for name, make in WORST_CASES.items():
+    print(f'[INFO] Timing {name}', file=sys.stderr)
+    worst_cases[name] = [
+      {
+        "size": size,
+        "regex": timed(split_by_regex, make(size)) if size <= args.regex_max_size else None,
+        "scanner": timed(split_by_scanner, make(size)),
+      }
+      for size in args.sizes
+    ]
+
+  print(json.dumps({ "mismatches": mismatches, "worst_cases": worst_cases }, indent=2))
+  if any(mismatches.values()):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+NKDOC = HERE.parent / 'nkdoc.py'
+
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+import nkdoc
+import corpus
+
+# Flags to build payloads with, by name.
+VARIANTS = {
+  'plain': [],
+  'indices': ['--index', 'search', '--index', 'signature', '--index', 'graph'],
+  'html, columnar': ['--html', '--format', 'columnar'],
+}
+
+
+def edit(words, count, seed=0):
+  """
+  Return a copy of `words` (word JSON objects) with descriptions of
+  `count` of them edited the way one would: refs added, effects
+  rewritten, words changed. Names stay the same, or the payload
+  couldn't be rebuilt incrementally.
+  """
+  rng = random.Random(seed)
+  words = [dict(word) for word in words]
+  names = [word["name"] for word in words]
+  for word in rng.sample(words, count):
+    desc = word["desc"]
+    choice = rng.randrange(4)
+    if choice == 0:
+      desc += f'\n\nSame as `{rng.choice(names)}`, but for Block.'
+    elif choice == 1:
+      desc = f'( Lb Fn -- Rq ): leaves Result quote for List block and Function. See `{rng.choice(names)}`.'
+    elif choice == 2:
+      desc = desc.replace('leaves', 'pushes')
+    else:
+      desc = desc.replace('Block', 'Quote', 1)
+    word["desc"] = desc
+  return words
+
+
+def write_corpus(path, words):
+  """Write `words` to `path`, one word JSON object per line."""
+  with open(path, 'w') as file:
+    for word in words:
+      print(json.dumps(word), file=file)
+
+
+def run_nkdoc(corpus_path, flags):
+  """
+  Run nkdoc.py on the corpus at `corpus_path` with `flags` in a
+  fresh process, and return what it printed to STDERR.
+  """
+  env = dict(os.environ, PYTHONHASHSEED='0')
+  with open(corpus_path) as stdin:
+    result = subprocess.run(
+      [sys.executable, str(NKDOC), *flags],
+      env=env, check=True, stdin=stdin, stderr=subprocess.PIPE, text=True
+    )
+  return result.stderr
+
+
+def read_payload(path):
+  """Read the payload at `path`, decoding it if it is columnar."""
+  payload = json.loads(Path(path).read_text())
+  if payload.get("format") == "columnar":
+    payload = nkdoc.from_columnar(payload)
+  return payload
+
+
+def check(directory, before, after, name, flags):
+  """
+  Check that rebuilding the payload of corpus `before` for corpus
+  `after` with `flags` (see `VARIANTS`) gives the same bytes as
+  building it from scratch, and that applying the delta from
+  one to the other does too. Files go to `directory`.
+  """
+  directory = Path(directory)
+  format = flags[flags.index('--format') + 1] if '--format' in flags else 'json'
+  # Deltas only have indices if asked to.
+  delta_flags = ['--delta', str(directory / 'delta.json')]
+  if '--index' in flags:
+    delta_flags.append('--delta-index')
+  previous = directory / 'previous.json'
+  full = directory / 'full.json'
+  rebuilt = directory / 'rebuilt.json'
+  build_info = directory / 'previous.build.json'
+  build_info.unlink(missing_ok=True)
+  run_nkdoc(before, [*flags, '--build-info', str(build_info), '--output', str(previous)])
+  run_nkdoc(after, [*flags, '--output', str(full)])
+  stderr = run_nkdoc(after, [
+    *flags, '--incremental', str(previous), '--build-info', str(build_info),
+    *delta_flags, '--output', str(rebuilt)
+  ])
+  delta = directory / 'delta.json'
+  applied = nkdoc.apply_delta(read_payload(previous), json.loads(delta.read_text()))
+  return {
+    "variant": name,
+    "incremental": 'Cannot rebuild incrementally' not in stderr,
+    "rebuilt": rebuilt.read_bytes() == full.read_bytes(),
+    "delta": nkdoc.encode_payload(applied, format).encode() == full.read_bytes(),
+    "delta_bytes": delta.stat().st_size,
+    "payload_bytes": full.stat().st_size,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Check that nkdoc.py --incremental rebuilds payloads of an edited synthetic corpus to the same bytes as full builds, and that --delta turns the previous payload into the new one. Print results as JSON.'
+  )
+  parser.add_argument(
+    '--words', type=int, default=2000, metavar='N',
+    help='size of the synthetic corpus, in words (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--edits', type=int, default=20, metavar='N',
+    help='number of words to edit (default: %(default)s)'
+  )
+  parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+  args = parser.parse_args()
+
+  words = corpus.generate(args.words, args.seed)
+  results = []
+  with tempfile.TemporaryDirectory() as directory:
+    before = Path(directory) / 'before.ndjson'
+    after = Path(directory) / 'after.ndjson'
+    write_corpus(before, words)
+    write_corpus(after, edit(words, args.edits, args.seed))
+    for name, flags in VARIANTS.items():
+      print(f'[INFO] Checking {name}', file=sys.stderr)
+      result = check(directory, before, after, name, flags)
+      for key in ("incremental", "rebuilt", "delta"):
+        if not result[key]:
+          print(f'[WARN] {name}: {key} check failed', file=sys.stderr)
+      results.append(result)
+
+  print(json.dumps(results, indent=2))
+  if not all(result[key] for result in results for key in ("incremental", "rebuilt", "delta")):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
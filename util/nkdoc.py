@@ -1,43 +1,240 @@
+import io
+import os
 import re
 import sys
+import gzip
 import json
-import nltk
+import time
+import pickle
+import marshal
+import sqlite3
+import socketserver
+import http.server
+import bisect
+import hashlib
+import argparse
+import functools
+import importlib
+import itertools
+import contextlib
+import tracemalloc
+import collections
 import math
-import mistune
-import numpy as np
-from copy import deepcopy
-from mistune.renderers.markdown import MarkdownRenderer
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version as version_of
 
 # nltk.download("punkt")
 # nltk.download('averaged_perceptron_tagger')
 
-class DictEq:
-  def __eq__(self, other):
-    if not isinstance(other, self.__class__):
-      return False
-    return self.__dict__ == other.__dict__
+
+class Timing:
+  """
+  Accumulates wall time spent in labeled parts of the run, in
+  the order they were first entered (see `--timing`).
+  """
+  def __init__(self):
+    self.spans = {}
+
+  @contextlib.contextmanager
+  def __call__(self, label):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.spans[label] = self.spans.get(label, 0) + time.perf_counter() - start
+
+  def report(self, file=sys.stderr):
+    """Print the time spent in each part to `file`."""
+    for label, seconds in self.spans.items():
+      print(f'[TIME] {label}: {seconds:.3f}s', file=file)
+
+
+TIMING = Timing()
+
+
+class Stats:
+  """
+  Collects metrics of a run (see `--stats`): wall and CPU time
+  spent, and number of words rewritten, in each stage overall
+  and in each rewriting round, and counts of things like calls
+  to NLTK or candidate collisions. With `tracemalloc`, also the
+  peak of memory allocated in each stage.
+  """
+  def __init__(self):
+    self.tracemalloc = False
+    self.reset()
+
+  def reset(self):
+    """Forget metrics collected so far."""
+    self.stages = {}
+    self.rounds = []
+    self.counts = collections.Counter()
+    self._round = None
+
+  def count(self, name, n=1):
+    """Add `n` to the count of `name`."""
+    self.counts[name] += n
+
+  def begin_round(self, barrier):
+    """Begin a rewriting round, crossing a `barrier` or not."""
+    self._round = { "barrier": barrier, "stages": {}, "transitioned": 0 }
+    self.rounds.append(self._round)
+
+  def end_round(self, transitioned):
+    """End the current round, in which `transitioned` words were rewritten to something else."""
+    self._round["transitioned"] = transitioned
+    self._round = None
+
+  @contextlib.contextmanager
+  def stage(self, name, words):
+    """Measure rewriting of `words` words at stage `name`."""
+    if self.tracemalloc:
+      tracemalloc.reset_peak()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+      yield
+    finally:
+      wall = time.perf_counter() - wall
+      cpu = time.process_time() - cpu
+      peak = tracemalloc.get_traced_memory()[1] if self.tracemalloc else None
+      for stages in (self.stages, self._round and self._round["stages"]):
+        if stages is None:
+          continue
+        stage = stages.setdefault(name, { "words": 0, "wall": 0, "cpu": 0 })
+        stage["words"] += words
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        if peak is not None:
+          stage["peak"] = max(stage.get("peak", 0), peak)
+
+  def to_dict(self):
+    """Return Python dict representation of the metrics."""
+    return { "stages": self.stages, "rounds": self.rounds, "counts": dict(self.counts) }
+
+
+STATS = Stats()
+
+
+@functools.cache
+def lazy(name):
+  """
+  Import and return module `name`. NLTK, NumPy and mistune take
+  a while to import, so they are only imported once a stage
+  needs them.
+  """
+  with TIMING(f'import {name}'):
+    return importlib.import_module(name)
+
+
+class DefinitionIndex:
+  """
+  Index of what members of a generation define shortnames as
+  (see `CandidatesWord.define`): for each shortname, offsets of
+  members that define it, in order, and scores and ids (see
+  `World.definition_id`) of their definitions.
+  """
+
+  __slots__ = ('_world', '_columns')
+
+  def __init__(self, world):
+    self._world = world
+    self._columns = {}
+
+  def add(self, offset, member):
+    """Index definitions of `member`, which is at `offset`."""
+    for shortname, candidate in member.definitions():
+      self.define(offset, shortname, candidate)
+
+  def define(self, offset, shortname, candidate):
+    """Record that the member at `offset` defines `shortname` as `candidate`."""
+    offsets, scores, ids = self._columns.setdefault(shortname, ([], [], []))
+    index = bisect.bisect_left(offsets, offset)
+    if index < len(offsets) and offsets[index] == offset:
+      scores[index] = candidate.score
+      ids[index] = self._world.definition_id(candidate)
+    else:
+      offsets.insert(index, offset)
+      scores.insert(index, candidate.score)
+      ids.insert(index, self._world.definition_id(candidate))
+
+  def lookup(self, shortname, begin, end):
+    """
+    Return a tuple of arrays of offsets, scores and ids of members
+    from `begin` up to `end` that define `shortname`.
+    """
+    np = lazy('numpy')
+    offsets, scores, ids = self._columns.get(shortname, ((), (), ()))
+    lo = bisect.bisect_left(offsets, begin)
+    hi = bisect.bisect_left(offsets, end, lo)
+    return (
+      np.array(offsets[lo:hi], dtype=np.intp),
+      np.array(scores[lo:hi], dtype=float),
+      np.array(ids[lo:hi], dtype=np.intp),
+    )
 
 
 class World:
   """
   World is a 1D discrete space inhabited by a *generation* of
-  *rewritable*, optionally *named* (hasattr name) objects pivoted
-  around one such object.
-
-  A 1D linear [0;1] `space` is available. `pivot` [0;1] is the
-  pivot's distance from origin in the linear space. `offset`
-  is the pivot's offset from the start of the generation
-  in the range [0; amount of generations).
+  *rewritable*, optionally *named* objects.
+
+  A 1D linear [0;1] `space` is available. Positions in it are
+  computed once, as are positions of named objects (the world
+  doesn't care which stage an object is at, only about where it
+  is), so the world can be shared by all objects throughout all
+  rounds of rewriting. Use `at` to pivot the world around one
+  of its objects.
+
+  `known` is the set of names of all existing words. It defaults
+  to names in the generation, and is useful when the generation
+  is only a part of all words.
+
+  `reads` maps offsets of members to lists of [begin, end) ranges
+  of offsets of members they fetched with `nth`, i.e., of neighbors
+  they looked at (see `read`). Similarly, `answers` maps offsets
+  of members to dicts of names they asked `is_word` about, and
+  the answers they got.
   """
-  def __init__(self, generation, names, offset):
-    self._names = names
+  def __init__(self, generation, names, known=None):
     self._generation = generation
-    self.space = np.linspace(0, 1, len(generation))
-    self.pivot = self.space[offset]
-    self.offset = offset
+    self._indices = {name: index for index, name in enumerate(names) if name is not None}
+    self._known = self._indices if known is None else known
+    self.space = lazy('numpy').linspace(0, 1, len(generation))
+    self.reads = {}
+    self.answers = {}
+    self._definitions = None
+    self._definition_ids = {}
+    self._definitions_by_id = []
+
+  def read(self, offset, n, end=None):
+    """
+    Record that the member at `offset` fetched the `n`th member,
+    or looked at members from the `n`th up to `end`. Neighbors are
+    mostly fetched in order, so ranges are kept rather than each
+    offset.
+    """
+    end = n + 1 if end is None else end
+    ranges = self.reads.setdefault(offset, [])
+    if ranges and ranges[-1][0] <= n <= ranges[-1][1]:
+      ranges[-1][1] = max(ranges[-1][1], end)
+    else:
+      ranges.append([n, end])
 
   def __getitem__(self, name):
-    return self._names[name]
+    return self._generation[self._indices[name]]
+
+  def offset_of(self, name):
+    """Return the offset of the member called `name`."""
+    return self._indices[name]
+
+  def at(self, offset):
+    """
+    Return a view of this world pivoted around its member
+    at `offset`.
+    """
+    return WorldView(self, offset)
 
   def nth(self, n):
     """
@@ -45,24 +242,156 @@ class World:
     """
     return self._generation[n]
 
-  def is_word(self, name):
+  def is_word(self, name, offset=None):
     """
-    Return whether `name` is the name of an existing word.
+    Return whether `name` is the name of an existing word. If the
+    member at `offset` asks, the answer is recorded in `answers`.
     """
-    return name in self._names
+    answer = name in self._known
+    if offset is not None:
+      self.answers.setdefault(offset, {})[name] = answer
+    return answer
 
   def get_pivot_set_for_names(self, names):
     """Return a set of pivots for the given word `names`."""
-    pivots = set()
-    for index, word in enumerate(self._generation):
-      if word.name in names:
-        pivots.add(self.space[index])
-    return pivots
+    indices = sorted(self._indices[name] for name in names if name in self._indices)
+    return set(self.space[index] for index in indices)
+
+  def definition_id(self, candidate):
+    """
+    Return the id of definitions equal to `candidate`. `definition`
+    returns the first of them seen.
+    """
+    if candidate not in self._definition_ids:
+      self._definition_ids[candidate] = len(self._definitions_by_id)
+      self._definitions_by_id.append(candidate)
+    return self._definition_ids[candidate]
+
+  def definition(self, id):
+    """Return the definition with the given `id`, see `definition_id`."""
+    return self._definitions_by_id[id]
+
+  def definitions(self, shortname, begin, end):
+    """
+    Return what members from `begin` up to `end` define `shortname`
+    as (see `CandidatesWord.define`): a tuple of arrays of their
+    offsets, in order, and of the scores and ids (see `definition_id`)
+    of their definitions.
+
+    Members are indexed on first call, so after that, they must
+    tell about definitions they change (see `redefine`).
+    """
+    if self._definitions is None:
+      self._definitions = DefinitionIndex(self)
+      for n, member in enumerate(self._generation):
+        self._definitions.add(n, member)
+    return self._definitions.lookup(shortname, begin, end)
+
+  def redefine(self, offset, shortname, candidate):
+    """Record that the member at `offset` now defines `shortname` as `candidate`."""
+    if self._definitions is not None:
+      self._definitions.define(offset, shortname, candidate)
+
+
+class WorldView:
+  """
+  A view of a `World` pivoted around one of its members.
+
+  `pivot` [0;1] is the pivot's distance from origin in the
+  linear space. `offset` is the pivot's offset from the start
+  of the generation in the range [0; amount of generations).
+  """
+
+  __slots__ = ('_world', 'offset')
+
+  def __init__(self, world, offset):
+    self._world = world
+    self.offset = offset
+
+  @property
+  def space(self):
+    return self._world.space
+
+  @property
+  def pivot(self):
+    return self._world.space[self.offset]
+
+  def __getitem__(self, name):
+    return self._world[name]
+
+  def nth(self, n):
+    self._world.read(self.offset, int(n))
+    return self._world.nth(n)
+
+  def is_word(self, name):
+    return self._world.is_word(name, self.offset)
+
+  def get_pivot_set_for_names(self, names):
+    return self._world.get_pivot_set_for_names(names)
+
+  def definition_id(self, candidate):
+    return self._world.definition_id(candidate)
+
+  def definition(self, id):
+    return self._world.definition(id)
+
+  def definitions(self, shortname, begin, end):
+    self._world.read(self.offset, begin, end)
+    return self._world.definitions(shortname, begin, end)
+
+  def redefine(self, shortname, candidate):
+    self._world.redefine(self.offset, shortname, candidate)
+
+
+class ReplayView(WorldView):
+  """
+  A view of a `World` whose members are not there, but instead
+  are obtained from `lookup(offset, n)` as the member at `offset`
+  should see them. The member itself is `member`. Similarly, what
+  members other than it define is obtained from `definitions(offset,
+  shortname, begin, end)`. See `replay`.
+  """
+
+  __slots__ = ('_member', '_lookup', '_definitions')
+
+  def __init__(self, world, offset, member, lookup, definitions):
+    super().__init__(world, offset)
+    self._member = member
+    self._lookup = lookup
+    self._definitions = definitions
+
+  def _get(self, n):
+    return self._member if n == self.offset else self._lookup(self.offset, n)
+
+  def __getitem__(self, name):
+    return self._get(self._world.offset_of(name))
+
+  def nth(self, n):
+    n = int(n)
+    self._world.read(self.offset, n)
+    return self._get(n)
+
+  def definitions(self, shortname, begin, end):
+    np = lazy('numpy')
+    self._world.read(self.offset, begin, end)
+    offsets, scores, ids = self._definitions(self.offset, shortname, begin, end)
+    if begin <= self.offset < end and (candidate := self._member.define(shortname)):
+      # Neighbors to the left come first, then the member itself.
+      at = np.searchsorted(offsets, self.offset)
+      offsets = np.insert(offsets, at, self.offset)
+      scores = np.insert(scores, at, candidate.score)
+      ids = np.insert(ids, at, self.definition_id(candidate))
+    return offsets, scores, ids
+
+  def redefine(self, shortname, candidate):
+    pass
 
 
 class WordDescView:
   """A view into a word's description."""
 
+  __slots__ = ('_desc', '_begin', '_end')
+
   def __init__(self, desc, begin=None, end=None):
     self._desc = desc
     self._begin = 0 if begin is None else begin
@@ -101,17 +430,21 @@ class WordDescView:
     return f'[|{self}|]'
 
 
-class WordObject(DictEq):
+class WordObject:
   """
   Word objects are created from JSON objects and simply destructure
   them. They are rewritten into `GameteWord`s.
   """
 
+  __slots__ = ('_object',)
+
   def __init__(self, obj):
     self._object = obj
 
   def rewrite(self, world):
-    name = self._object["name"]
+    # Names are everywhere (in refs, candidates etc.), so they're
+    # interned to be stored once.
+    name = sys.intern(self._object["name"])
     desc = self._object["desc"]
     return GameteWord(name, WordDescView(desc))
 
@@ -123,22 +456,153 @@ RE_SLASH_IN_TOKEN = re.compile(r'/|(?<=^[A-Z])\.(?=$)')
 
 RE_MARKDOWN_B = re.compile(r'[^:\s]')
 
-RE_EFFECT_B = re.compile(r'^\(')
-RE_EFFECT_E = re.compile(r'\)(?:[^)]*?:|\s*$)')
-
-RE_TAKES = re.compile(r'\((.*?)\s+--(?:\s+|$)')
-
 RE_SAME_AS = re.compile(r'\s*(?:same\s*as|(?:version|variation)\s*of)\s*$')
 RE_FIRST_SENTENCE = re.compile(r'^(.*?)[.?!]\s', re.DOTALL)
 
 
-class GameteWord(DictEq):
+RE_EFFECT_TOKEN = re.compile(r'\w+')
+
+
+class CountedPattern:
+  """
+  Wraps compiled regex `pattern` named `name`, counting calls
+  of its methods in `STATS`.
+  """
+  def __init__(self, name, pattern):
+    self._name = name
+    self._pattern = pattern
+
+  def __getattr__(self, attr):
+    method = getattr(self._pattern, attr)
+    if not callable(method):
+      return method
+    def _counted(*args, **kwargs):
+      STATS.count(f'regex {self._name}')
+      return method(*args, **kwargs)
+    return _counted
+
+
+def count_regex_calls():
+  """Make module-level `RE_*` patterns count their calls in `STATS`."""
+  for name, value in list(globals().items()):
+    if name.startswith('RE_') and isinstance(value, re.Pattern):
+      globals()[name] = CountedPattern(name, value)
+
+
+class EffectIndex:
+  """
+  An index of tokens (runs of word characters) in a part of an
+  effect, e.g. in takes or in leaves. Maps each token to offsets
+  of its occurrences, in order.
+  """
+
+  __slots__ = ('_effect', '_offsets')
+
+  def __init__(self, effect):
+    self._effect = effect
+    self._offsets = {}
+    for match in RE_EFFECT_TOKEN.finditer(effect):
+      self._offsets.setdefault(match.group(), []).append(match.start())
+
+  def offsets(self, token):
+    """
+    Return offsets of occurrences of `token` delimited by word
+    boundaries (as in regex '\\btoken\\b') in the effect.
+    """
+    if RE_EFFECT_TOKEN.fullmatch(token):
+      # A run of word characters delimited by word boundaries is
+      # exactly one of the indexed tokens.
+      return self._offsets.get(token, ())
+    return [match.start() for match in re.finditer(f'\\b{re.escape(token)}\\b', self._effect)]
+
+  def __contains__(self, token):
+    return bool(self.offsets(token))
+
+  def __str__(self):
+    return self._effect
+
+  def __repr__(self):
+    return f'<EffectIndex {self._effect!r} />'
+
+
+def find_effect(desc):
+  """
+  Find the end of the effect in `desc`, which must begin with '('.
+  Return a tuple of the offset of the (roughly) corresponding ')',
+  and of the end of the effect: after the first ':' between it and
+  the next ')', or at the end of `desc` if there's only whitespace
+  after it. Return None if there's no such ')'.
+  """
+  if not desc.startswith('('):
+    return None
+  close = desc.find(')')
+  if close < 0:
+    return None
+  # No ')' before the first ':' after the first ')' can be followed
+  # by a ':' before the next ')', except the last one.
+  colon = desc.find(':', close + 1)
+  if colon >= 0:
+    return desc.rfind(')', 0, colon), colon + 1
+  close = desc.rfind(')')
+  if close + 1 == len(desc) or desc[close + 1:].isspace():
+    return close, len(desc)
+  return None
+
+
+def split_effect(effect):
+  """
+  Split `effect` into what it takes and what it leaves. Return a
+  list of (begin, end) spans of takes in `effect`, and the offset
+  of leaves, which go on to the end of `effect`.
+
+  Takes of nested effects are split off the front of `effect` one
+  by one: each begins after a leading '(', and ends before the
+  first '--' (on the same line) with whitespace on both sides, or
+  with whitespace before and nothing after. What follows, including
+  any ')', is left for the next one, or for leaves.
+
+  Runs in time linear in the length of `effect`.
+  """
+  takes = []
+  begin = 0
+  newline = -1
+  while effect.startswith('(', begin):
+    # Look for the next newline only once past the last one found,
+    # or effects with many takes would be scanned again for each.
+    if newline <= begin:
+      newline = effect.find('\n', begin + 1)
+      newline = len(effect) if newline < 0 else newline
+    dashes = effect.find('--', begin + 1)
+    while dashes >= 0:
+      # Takes end where the whitespace before '--' begins, and may
+      # not span lines. Whitespace before and after '--' may.
+      end = dashes
+      while end > begin + 1 and effect[end - 1].isspace():
+        end -= 1
+      if end > newline:
+        return takes, begin
+      after = dashes + 2
+      if end < dashes and (after == len(effect) or effect[after].isspace()):
+        break
+      dashes = effect.find('--', dashes + 1)
+    else:
+      return takes, begin
+    takes.append((begin + 1, end))
+    while after < len(effect) and effect[after].isspace():
+      after += 1
+    begin = after
+  return takes, begin
+
+
+class GameteWord:
   """
   Gamete words separate effect and parts of effect from markdown in
   a noise-tolerant way. Gamete words are first words to know (and be
   known by) their `name`. They are rewritten to `ZygoteWord`s.
   """
 
+  __slots__ = ('name', '_desc')
+
   def __init__(self, name, desc):
     self.name = name
     self._desc = desc
@@ -146,14 +610,14 @@ class GameteWord(DictEq):
   def rewrite(self, world):
     # Try to find effect opening bracket and the (roughly) corresponding
     # closing bracket.
-    b = RE_EFFECT_B.match(self._desc.get())
-    e = RE_EFFECT_E.search(self._desc.get())
+    found = find_effect(self._desc.get())
     effectish = None
-    if b and e:
-      effect = self._desc.within(b.start(), e.start() - 1)
-      markdown = self._desc.after(e.end())
+    if found:
+      close, end = found
+      effect = self._desc.within(0, close - 1)
+      markdown = self._desc.after(end)
       if mdb := RE_MARKDOWN_B.search(markdown.get()):
-        effectish = self._desc.within(b.start(), e.end() + mdb.start() - 1)
+        effectish = self._desc.within(0, end + mdb.start() - 1)
         markdown = markdown.after(mdb.start())
     else:
       effect = self._desc.empty()
@@ -165,36 +629,294 @@ class GameteWord(DictEq):
     # haven't visited an "after". We may have nested effects, you see.
     # The point is to sort everything either "to the left" (takes) or
     # "to the right" (leaves). At least that's the idea.
-    takes = ''
-    if leaves := effect.get():
-      while match := RE_TAKES.match(leaves):
-        takes += match.group(1)
-        leaves = leaves[:match.start()] + leaves[match.end():]
+    effect = effect.get()
+    spans, leaves = split_effect(effect)
+    takes = ''.join(effect[begin:end] for begin, end in spans)
+    leaves = effect[leaves:]
     return ZygoteWord(self.name, effectish.get(), takes, leaves, markdown.get())
 
   def __repr__(self):
     return f'<GameteWord {self.name=} />'
 
 
-class AssocRenderer(MarkdownRenderer):
-  def __init__(self, on_text, on_codespan):
-    super().__init__()
-    self.on_text = on_text
-    self.on_codespan = on_codespan
+@functools.cache
+def get_assoc_markdown():
+  """
+  Return a markdown parser, which parses markdown to tokens; the
+  `AssocRenderer` that renders tokens back to markdown; and the
+  `LinkingRenderer` that renders them to sanitized HTML. A single
+  set is shared by all zygote words. Each swaps in its own
+  callbacks before rendering its markdown.
+  """
+  mistune = lazy('mistune')
+
+  class AssocRenderer(lazy('mistune.renderers.markdown').MarkdownRenderer):
+    def __init__(self, on_text=None, on_codespan=None):
+      super().__init__()
+      self.on_text = on_text
+      self.on_codespan = on_codespan
+
+    def text(self, token, state):
+      self.on_text(token["raw"])
+      return super().text(token, state)
+
+    def softbreak(self, token, state):
+      return ' '
+
+    def codespan(self, token, state):
+      self.on_codespan(token["raw"])
+      return super().codespan(token, state)
+
+  class LinkingRenderer(mistune.HTMLRenderer):
+    def __init__(self, is_link=None):
+      # Escape raw HTML, and drop harmful links (javascript: etc.)
+      super().__init__(escape=True)
+      self.is_link = is_link
+
+    def codespan(self, text):
+      code = super().codespan(text)
+      if not self.is_link(text):
+        return code
+      # Link by name for now, see `link_html`.
+      return f'<a class="word" href="#\0{text}\0">{code}</a>'
+
+  return mistune.Markdown(), AssocRenderer(), LinkingRenderer()
+
+
+# Links to words in HTML of words (see `LinkingRenderer`), by name
+# before `link_html`, and by index after.
+RE_HTML_LINK_NAME = re.compile('\0([^\0]*)\0')
+RE_HTML_LINK_INDEX = re.compile(r'(?<=<a class="word" href="#)\d+(?=">)')
+
+
+def link_html(html, word_to_index):
+  """Make links to words in `html` refer to them by index."""
+  return RE_HTML_LINK_NAME.sub(lambda match: str(word_to_index[match[1]]), html)
+
+
+def unlink_html(html, names):
+  """Undo `link_html`, given the list of word `names`."""
+  return RE_HTML_LINK_INDEX.sub(lambda match: f'\0{names[int(match[0])]}\0', html)
+
+
+# NLTK resources of the models we use.
+PUNKT_RESOURCE = 'tokenizers/punkt_tab/english/'
+TAGGER_RESOURCE = 'taggers/averaged_perceptron_tagger_eng/'
+
+# Where to keep a snapshot of the models, if anywhere. Set from
+# `--cache`, see `get_models`.
+MODELS_SNAPSHOT = None
+
+# Version of what's in the snapshot, part of `models_stamp`.
+MODELS_SNAPSHOT_VERSION = 2
 
-  def text(self, token, state):
-    self.on_text(token["raw"])
-    return super().text(token, state)
 
-  def softbreak(self, token, state):
-    return ' '
+def models_stamp(nltk):
+  """
+  Return what identifies the version of the models: the version
+  of NLTK and of the snapshot, and paths, sizes and modification
+  times of the model files.
+  """
+  stamp = [nltk.__version__, MODELS_SNAPSHOT_VERSION]
+  for resource in (PUNKT_RESOURCE, TAGGER_RESOURCE):
+    path = Path(str(nltk.data.find(resource)))
+    stamp.append(str(path))
+    if path.is_dir():
+      for file in sorted(path.iterdir()):
+        stat = file.stat()
+        stamp.append((file.name, stat.st_size, stat.st_mtime_ns))
+  return tuple(stamp)
+
+
+@functools.cache
+def get_models():
+  """
+  Return punkt parameters, and the perceptron tagger's weights,
+  tag dictionary and classes.
+
+  Loading the tagger from NLTK's JSON files takes a while, so if
+  `MODELS_SNAPSHOT` is set, both are kept there in marshal format,
+  which loads in a fraction of the time. The snapshot is rebuilt
+  whenever the models change (see `models_stamp`).
+  """
+  nltk = lazy('nltk')
+  with TIMING('load models'):
+    stamp = models_stamp(nltk)
+    if MODELS_SNAPSHOT:
+      with contextlib.suppress(OSError, EOFError, ValueError, TypeError):
+        snapshot_stamp, punkt, tagger = marshal.loads(Path(MODELS_SNAPSHOT).read_bytes())
+        if snapshot_stamp == stamp:
+          return punkt, tagger
+    params = nltk.tokenize.punkt.load_punkt_params(nltk.data.find(PUNKT_RESOURCE))
+    punkt = (params.abbrev_types, params.collocations, params.sent_starters, dict(params.ortho_context))
+    perceptron = nltk.tag.PerceptronTagger()
+    # Tags are decoded from JSON as separate strings. Intern them,
+    # so that the model and all tagged tokens share a handful of
+    # them (marshal keeps them interned, too).
+    intern = sys.intern
+    tagger = (
+      {feature: {intern(tag): weight for tag, weight in weights.items()} for feature, weights in perceptron.model.weights.items()},
+      {token: intern(tag) for token, tag in perceptron.tagdict.items()},
+      sorted(map(intern, perceptron.classes)),
+    )
+    if MODELS_SNAPSHOT:
+      path = Path(MODELS_SNAPSHOT)
+      path.parent.mkdir(parents=True, exist_ok=True)
+      # Pool workers may all write it at once, each to their own
+      # temporary file.
+      temp = path.with_suffix(f'.{os.getpid()}.tmp')
+      temp.write_bytes(marshal.dumps((stamp, punkt, tagger)))
+      temp.replace(path)
+    return punkt, tagger
+
+
+@functools.cache
+def get_sent_tokenizer():
+  """Return the sentence tokenizer `nltk.sent_tokenize` uses."""
+  abbrev_types, collocations, sent_starters, ortho_context = get_models()[0]
+  punkt = lazy('nltk.tokenize.punkt')
+  params = punkt.PunktParameters()
+  params.abbrev_types = set(abbrev_types)
+  params.collocations = set(collocations)
+  params.sent_starters = set(sent_starters)
+  params.ortho_context = collections.defaultdict(int, ortho_context)
+  tokenizer = punkt.PunktSentenceTokenizer()
+  tokenizer._params = params
+  return tokenizer
+
+
+@functools.cache
+def get_word_tokenizer():
+  """Return the word tokenizer `nltk.word_tokenize` uses."""
+  return lazy('nltk').tokenize.NLTKWordTokenizer()
+
+
+@functools.cache
+def get_tagger():
+  """Return the POS tagger `nltk.pos_tag` uses."""
+  tagger = lazy('nltk').tag.PerceptronTagger(load=False)
+  tagger.decode_json_params(get_models()[1])
+  return tagger
+
+
+class Memo:
+  """
+  A least recently used memo of up to `size` results. Counts
+  hits, misses, and evictions of old results to make room for
+  new ones.
+  """
+  def __init__(self, size):
+    self.size = size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._results = collections.OrderedDict()
+
+  def get(self, key):
+    """Return the result memoized under `key`, or None."""
+    result = self._results.get(key)
+    if result is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self._results.move_to_end(key)
+    return result
+
+  def put(self, key, result):
+    """Memoize `result` under `key`."""
+    self._results[key] = result
+    while len(self._results) > self.size:
+      self._results.popitem(last=False)
+      self.evictions += 1
+
+
+# Docstrings repeat a lot ("same as `x`, but ...", boilerplate
+# about blocks and quotes), so tokens and tags of recently seen
+# sentences are memoized. See `--memo-size`.
+MEMO_SIZE = 4096
+SENTENCE_TOKENS = Memo(MEMO_SIZE)
+SENTENCE_TAGS = Memo(MEMO_SIZE)
 
-  def codespan(self, token, state):
-    self.on_codespan(token["raw"])
-    return super().codespan(token, state)
+
+def sent_tokenize_all(texts):
+  """
+  Split each of `texts` into sentences. Same as calling
+  `nltk.sent_tokenize` on each, but in one go.
+  """
+  STATS.count('nltk sent_tokenize', len(texts))
+  return get_sent_tokenizer().tokenize_sents(texts)
+
+
+def word_tokenize_all(texts):
+  """
+  Split each of `texts` into sentences, and each sentence into
+  a tuple of tokens. Same as calling `nltk.word_tokenize` on each
+  sentence, except that tokens are also split on '/': NLTK's
+  tokenizer doesn't consider it a delimiter but we do.
+  """
+  result = []
+  for sentences in sent_tokenize_all(texts):
+    tokenized = []
+    for sentence in sentences:
+      tokens = SENTENCE_TOKENS.get(sentence)
+      if tokens is None:
+        STATS.count('nltk word_tokenize')
+        tokens = tuple(
+          sys.intern(piece)
+          for token in get_word_tokenizer().tokenize(sentence)
+          for piece in RE_SLASH_IN_TOKEN.split(token)
+          if piece
+        )
+        SENTENCE_TOKENS.put(sentence, tokens)
+      tokenized.append(tokens)
+    result.append(tokenized)
+  return result
+
+
+def pos_tag_all(sentences):
+  """
+  POS-tag tuples of tokens in `sentences` as a whole, as if they
+  were one sentence. Same as calling `nltk.pos_tag` on all tokens.
+
+  The tagger looks two tokens and two tags back, and two tokens
+  ahead, also across sentences. So tags of a sentence are only
+  memoized for the same tags before it and the same (normalized)
+  tokens around it.
+  """
+  tagger = get_tagger()
+  tokens = [token for tokens in sentences for token in tokens]
+  context = [*tagger.START, *(tagger.normalize(token) for token in tokens), *tagger.END]
+  prev, prev2 = tagger.START
+  tagged = []
+  # Offset of the first token of the sentence in `tokens`; in
+  # `context`, it is offset by the two START entries.
+  offset = 0
+  for tokens in sentences:
+    end = offset + len(tokens)
+    key = (prev2, prev, *context[offset:offset + 2], tokens, *context[end + 2:end + 4])
+    tags = SENTENCE_TAGS.get(key)
+    if tags is None:
+      STATS.count('nltk tag', len(tokens))
+      tags = []
+      for index, token in enumerate(tokens, offset):
+        tag = tagger.tagdict.get(token)
+        if not tag:
+          STATS.count('nltk predict')
+          features = tagger._get_features(index, token, context, prev, prev2)
+          tag, _ = tagger.model.predict(features)
+        tags.append(tag)
+        prev2 = prev
+        prev = tag
+      tags = tuple(tags)
+      SENTENCE_TAGS.put(key, tags)
+    else:
+      prev2, prev = (prev2, prev, *tags)[-2:]
+    tagged.extend(zip(tokens, tags))
+    offset = end
+  return tagged
 
 
-class ZygoteWord(DictEq):
+class ZygoteWord:
   """
   Zygote words parse markdown, creating a "corpus" (a string
   that consists of only raw text) and tracking outbound refs
@@ -207,17 +929,28 @@ class ZygoteWord(DictEq):
   Zygote words are rewritten into `NLPWords`s. The reference
   to a zygote word is kept throughout all later stages of the
   word. So in later stages zygote words are used as containers
-  for basic word data.
+  for basic word data, including the primer and outbound refs.
+  Later stages only keep their own data (e.g. the corpus, or
+  tagged tokens), so it's gone as soon as the word moves on.
   """
 
+  __slots__ = ('name', 'takes', 'effect', 'leaves', 'markdown', 'html', 'primer', 'outbound')
+
   def __init__(self, name, effect, takes, leaves, markdown):
     self.name = name
-    self.takes = takes
+    self.takes = EffectIndex(takes)
     self.effect = effect
-    self.leaves = leaves
+    self.leaves = EffectIndex(leaves)
     self.markdown = markdown
+    self.html = None
+    self.primer = None
+    self.outbound = None
 
-  def rewrite(self, world):
+  def _render(self, world):
+    """
+    Render markdown of this word, and its HTML, and return its
+    corpus and outbound objects.
+    """
     corpus = []
     same_as_words = set()
     outbound_words = set()
@@ -236,12 +969,18 @@ class ZygoteWord(DictEq):
       if corpus and RE_SAME_AS.search(corpus[-1], re.IGNORECASE):
         same_as_words.add(name)
       corpus.append('...')
-      outbound_words.add(name)
+      outbound_words.add(sys.intern(name))
     # Render markdown using the assoc rendered, which will call
-    # the functions above.
-    render = mistune.create_markdown(renderer=AssocRenderer(_assoc_corpus, _assoc_possible_outbound))
-    rendered = render(self.markdown)
-    self.markdown = rendered
+    # the functions above. HTML is rendered from the same tokens,
+    # with links to words we've found. NUL is replaced as in
+    # CommonMark; it would be mistaken for a link otherwise.
+    markdown, renderer, html_renderer = get_assoc_markdown()
+    renderer.on_text = _assoc_corpus
+    renderer.on_codespan = _assoc_possible_outbound
+    html_renderer.is_link = lambda name: name in outbound_words
+    tokens, state = markdown.parse(self.markdown.replace('\0', '\ufffd'))
+    self.markdown = renderer(tokens, state)
+    self.html = html_renderer(tokens, state)
     # Produce a list of "outbound" objects. Their score depends
     # on the "degree of the bound": a same-as bound is obviously
     # stronger than a simple "see" reference.
@@ -253,16 +992,30 @@ class ZygoteWord(DictEq):
         "strength": 1 if same_as else 0.5,
         "same-as": same_as
       })
+    return ' '.join(datum.strip() for datum in corpus), outbound
+
+  def rewrite(self, world):
+    return ZygoteWord.rewrite_all([self], [world])[0]
+
+  @staticmethod
+  def rewrite_all(zygotes, worlds):
+    """
+    Rewrite all `zygotes` at once, splitting all of their
+    markdowns into sentences in one go.
+    """
+    rendered = [zygote._render(world) for zygote, world in zip(zygotes, worlds)]
     # Replace horizontal/vertical whitespace in the markdown
     # with simple ' '.
-    inline_markdown = RE_WS.sub(' ', self.markdown)
+    inline_markdowns = [RE_WS.sub(' ', zygote.markdown) for zygote in zygotes]
     # Use the first sentence of the markdown as the primer.
-    primer = nltk.sent_tokenize(inline_markdown)
-    primer = '' if len(primer) == 0 else primer[0]
-    return NLProcessorWord(self, ' '.join(datum.strip() for datum in corpus), primer, outbound)
+    primers = [sentences[0] if sentences else '' for sentences in sent_tokenize_all(inline_markdowns)]
+    for zygote, (_, outbound), primer in zip(zygotes, rendered, primers):
+      zygote.outbound = outbound
+      zygote.primer = primer
+    return [NLProcessorWord(zygote, corpus) for zygote, (corpus, _) in zip(zygotes, rendered)]
 
   def __repr__(self):
-    return f'<ZygoteWord {self.name=} {self.takes=} {self.leaves=} {self.markdown=} />'
+    return f'<ZygoteWord {self.name=} {self.takes=} {self.leaves=} {self.markdown=} {self.outbound=} />'
 
 
 # List of tags (sort of like parts of speech I guess) to
@@ -278,7 +1031,7 @@ SKIPTAG_UC = ('IN',)
 SKIPTOKEN = ('am', 'is', 'are', 'was', 'were', 'be', 'been', 'not', 'try', 'need', 'using', 'utilizing', '(', ')', '[', ']', '{', '}')
 
 
-class NLProcessorWord(DictEq):
+class NLProcessorWord:
   """
   At this stage of word processing happens most of the NLP
   (some had already happened in `ZygoteWord`).
@@ -286,20 +1039,15 @@ class NLProcessorWord(DictEq):
   `NLProcessorWord`s are rewritten to `TaggedCorpusWord`s.
   """
 
-  def __init__(self, zygote, corpus, primer, outbound):
+  __slots__ = ('_zygote', 'corpus', 'name')
+
+  def __init__(self, zygote, corpus):
     self._zygote = zygote
     self.corpus = corpus
-    self.primer = primer
-    self.outbound = outbound
     self.name = zygote.name
 
-  def rewrite(self, world):
-    # Remove tokens we're SURE are NOT referring to effect stuff POS-wise.
-    tokens = nltk.word_tokenize(self.corpus)
-    # Split on '/' too, NLTK's tokenizer doesn't consider it a delimiter
-    # but we do.
-    tokens = [piece for token in tokens for piece in RE_SLASH_IN_TOKEN.split(token) if piece]
-    tagged = nltk.pos_tag(tokens)
+  def _filter(self, tagged):
+    """Remove tokens we're SURE are NOT referring to effect stuff POS-wise."""
     tagged_new = []
     for (token, tag) in tagged:
       # Skip any capitalized words. We can't reject them without
@@ -321,10 +1069,23 @@ class NLProcessorWord(DictEq):
         tagged_new.append(())
         continue
       tagged_new.append((token, tag))
-    return TaggedCorpusWord(self._zygote, self, tagged_new)
+    return TaggedCorpusWord(self._zygote, tagged_new)
+
+  def rewrite(self, world):
+    return NLProcessorWord.rewrite_all([self], [world])[0]
+
+  @staticmethod
+  def rewrite_all(words, worlds):
+    """
+    Rewrite all `words` at once: tokenize and POS-tag the corpora
+    of all words in one go, then hand each word its share.
+    """
+    sentences = word_tokenize_all([word.corpus for word in words])
+    # Each word is tagged as a whole, as if it were one sentence.
+    return [word._filter(pos_tag_all(sentences)) for word, sentences in zip(words, sentences)]
 
   def __repr__(self):
-    return f'<NLProcessorWord {self._predecessor=} {self.corpus=} {self.outbound=} />'
+    return f'<NLProcessorWord {self._zygote=} {self.corpus=} />'
 
 
 SCORE_DELTA_SKIPT = -0.5
@@ -336,14 +1097,53 @@ SCORE_DELTA_REFERENCED = 1
 class Candidate:
   """
   Represents a candidate effect which can span multiple POS-tagged tokens.
+
+  Tokens are immutable once the candidate is made, so candidates
+  borrowed by other words (see `borrow`) share them instead of
+  copying.
   """
 
-  def __init__(self, owner):
-    self.tokens = []
-    self.score = 0
+  __slots__ = ('tokens', 'score', 'owner', '_texts', '_hash')
+
+  def __init__(self, owner, tokens, score=0):
+    self.tokens = tokens
+    self.score = score
     self.owner = owner
-    self._prefix = ''
-    self._cmp_tokens = ()
+    # Have the texts of `tokens` at hand for hash() and comparison.
+    self._texts = tuple(text for (text, _, _) in tokens)
+    self._hash = hash(self._texts)
+
+  @classmethod
+  def of(cls, owner, entries):
+    """
+    Make a candidate owned by `owner` from a list of `(text, tag)`
+    POS-tagged `entries`.
+    """
+    tokens = []
+    score = 0
+    prefix = ''
+    for (text, tag) in entries:
+      # For each token, construct prefix choice.
+      #
+      # For example, for tokens:
+      #   [('Struct', 'NNP'), ('view', 'NN'), ('form', 'NN')]
+      #
+      # Prefix choice would be:
+      #   [('Struct', 'NNP', 'S'), ('view', 'NN', 'Sv'), ('form', 'NN', 'Svf')].
+      prefix += text[0]
+      # As an heuristic, skiptag/skiptoken entries are punished
+      # a bit.
+      if tag in SKIPTAG or text in SKIPTOKEN:
+        score += SCORE_DELTA_SKIPT
+      # As yet another heuristic, having a capitalized noun
+      # means a teeny-tiny buff to the group overall.
+      if text[0].isupper() and tag.startswith('NN'):
+        score += SCORE_DELTA_NN
+        # However, being a plural noun NNS is punished just a bit.
+        if tag == 'NNS':
+          score += SCORE_DELTA_NNS
+      tokens.append((text, tag, prefix))
+    return cls(owner, tuple(tokens), score)
 
   def referenced(self):
     """Add a bit of score in case this candidate is referenced somewhere."""
@@ -351,44 +1151,18 @@ class Candidate:
 
   def empty(self):
     """Return whether the list of tokens is empty."""
-    return len(self.tokens) == 0
-
-  def append(self, token):
-    """Append a new constituent token."""
-    (text, tag) = token
-    # For each token, construct prefix choice.
-    #
-    # For example, for tokens:
-    #   [('Struct', 'NNP'), ('view', 'NN'), ('form', 'NN')]
-    #
-    # Prefix choice would be:
-    #   [('Struct', 'NNP', 'S'), ('view', 'NN', 'Sv'), ('form', 'NN', 'Svf')].
-    self._prefix += text[0]
-    # As an heuristic, skiptag/skiptoken entries are punished
-    # a bit.
-    if tag in SKIPTAG or text in SKIPTOKEN:
-      self.score += SCORE_DELTA_SKIPT
-    # As yet another heuristic, having a capitalized noun
-    # means a teeny-tiny buff to the group overall.
-    if text[0].isupper() and tag.startswith('NN'):
-      self.score += SCORE_DELTA_NN
-      # However, being a plural noun NNS is punished just a bit.
-      if tag == 'NNS':
-        self.score += SCORE_DELTA_NNS
-    self.tokens.append((text, tag, self._prefix))
-    # Have an immutable `tokens`` at hand for hash() and comparison.
-    self._cmp_tokens = (*self._cmp_tokens, text)
+    return not self.tokens
 
   def short(self):
     """Return this candidate's short name."""
-    return self._prefix
+    return self.tokens[-1][2] if self.tokens else ''
 
   def long(self):
     """
     Join the tokens of this candidate into one string, this
     candidate's long name.
     """
-    return " ".join(token for (token, _, _) in self.tokens)
+    return " ".join(self._texts)
 
   def to_dict(self):
     """Return Python dict representation of this candidate."""
@@ -400,92 +1174,96 @@ class Candidate:
 
   def prefix_found_in(self, effect, prefix=None):
     """
-    Return whether `prefix` can be found in `effect`. When
-    `prefix` is None, use this candidate's shortname.
+    Return whether `prefix` can be found in `effect`, an
+    `EffectIndex`. When `prefix` is None, use this candidate's
+    shortname.
     """
     prefix = prefix if prefix else self.short()
-    return re.search(f'\\b{re.escape(prefix)}\\b', effect) is not None
+    return prefix in effect
 
   def purge(self, takes, leaves):
     """
-    Remove constituent tokens after the last one whose prefix (shortname)
-    was found in `effect`. Return whether the entire candidate doesn't
-    match (and therefore needs to be purged wholly, which is out of
-    the candidate's own reach).
+    Return this candidate without the constituent tokens after
+    the last one whose prefix (shortname) was found in `takes`
+    or `leaves`. Return None if the entire candidate doesn't
+    match (and therefore needs to be purged wholly, which is out
+    of the candidate's own reach).
     """
-    matching_indices = []
+    last = None
     for index, (_, _, prefix) in enumerate(self.tokens):
       if self.prefix_found_in(takes, prefix) or self.prefix_found_in(leaves, prefix):
-        matching_indices.append(index)
-    if not matching_indices:
+        last = index
+    if last is None:
       # If none of the prefixes match, reject the whole chunk.
-      return True
+      return None
+    if last + 1 == len(self.tokens):
+      return self
     # Reject the rest of the chunk after last successful
     # prefix match.
-    self.tokens = self.tokens[:matching_indices[-1] + 1]
-    self._cmp_tokens = tuple(token for (token, _, _) in self.tokens)
-    self._prefix = self.tokens[-1][-1]
-    return False
+    return Candidate(self.owner, self.tokens[:last + 1], self.score)
 
   def mergescore(self, other):
     """Merge the score of this and `other` candidates."""
     self.score += other.score
 
-  def scale(self, factor):
-    """Scale this candidate's score by `factor` (e.g. 1.1, 0.3, etc.)"""
-    self.score *= factor
+  def borrow(self, factor):
+    """
+    Return a candidate that shares the tokens of this one, with
+    score scaled by `factor` (e.g. 1.1, 0.3, etc.)
+    """
+    borrowed = Candidate.__new__(Candidate)
+    borrowed.tokens = self.tokens
+    borrowed.score = self.score * factor
+    borrowed.owner = self.owner
+    borrowed._texts = self._texts
+    borrowed._hash = self._hash
+    return borrowed
 
   def __iter__(self):
     return iter(self.tokens)
 
-  def __deepcopy__(self, memo):
-    obj = type(self).__new__(self.__class__)
-    for k, v in self.__dict__.items():
-      obj.__dict__[k] = deepcopy(v, memo)
-    return obj
-
   def __eq__(self, other):
     if isinstance(other, Candidate):
-      return self._cmp_tokens == other._cmp_tokens
+      return self._texts is other._texts or self._texts == other._texts
     return False
 
   def __hash__(self):
-    return hash(self._cmp_tokens)
+    return self._hash
 
   def __repr__(self):
     return f'<Candidate "{self.long()}" score={self.score} />'
 
 
-class TaggedCorpusWord(DictEq):
+class TaggedCorpusWord:
   """
   `TaggedCorpusWord` transforms the tagged corpus into a list of
   `Candidate`s, and passes that to `CandidatesWord` into which
   it is rewritten.
   """
 
-  def __init__(self, zygote, predecessor, tagged):
+  __slots__ = ('_zygote', 'tagged', 'name')
+
+  def __init__(self, zygote, tagged):
     self._zygote = zygote
-    self._predecessor = predecessor
     self.tagged = tagged
     self.name = zygote.name
 
   def rewrite(self, world):
     # Group by first capital letter or gap ()
-    top = Candidate(self.name)
-    stack = [top]
+    groups = [[]]
     for entry in self.tagged:
       if entry == () or entry[0][0].isupper():
-        top = Candidate(self.name)
-        stack.append(top)
+        groups.append([])
         if entry == ():
           continue
-      top.append(entry)
+      groups[-1].append(entry)
     seen = {}
-    for candidate in stack:
-      if candidate.empty():
+    for group in groups:
+      if not group:
         continue
-      if candidate.purge(self._zygote.takes, self._zygote.leaves):
-        # `purge` returns true when the whole candidate has to
+      candidate = Candidate.of(self.name, group).purge(self._zygote.takes, self._zygote.leaves)
+      if candidate is None:
+        # `purge` returns None when the whole candidate has to
         # be purged; so we skip it
         continue
       candidate.referenced()
@@ -498,19 +1276,39 @@ class TaggedCorpusWord(DictEq):
     # resolving ambiguity in case one of the ambiguous candidates
     # has higher score.
     candidates = sorted(seen.values(), key=lambda candidate: candidate.score)
-    return CandidatesWord(self._zygote, self._predecessor, candidates)
+    STATS.count('candidates', len(candidates))
+    return CandidatesWord(self._zygote, candidates)
 
 
-FCLAMP = np.vectorize(lambda x: min(x, 1))
+# Neighbors are weighed by a tabletop Gaussian, see `CandidatesWord`.
+# Weights below the threshold are considered zero, so pivots only
+# reach neighbors within `WEIGHT_RADIUS` of themselves.
+WEIGHT_A = 0.05
+WEIGHT_N = 4
+WEIGHT_THRESHOLD = 0.05
+WEIGHT_RADIUS = WEIGHT_A * (-math.log(WEIGHT_THRESHOLD)) ** (1 / WEIGHT_N)
 
 
-class CandidatesWord(DictEq):
-  def __init__(self, zygote, predecessor, candidates):
+class CandidatesWord:
+  # Candidates words borrow candidates from the words they refer
+  # to, and look at candidates of their neighbors. So they must
+  # all see each other at this stage, and none may see the next.
+  reads_neighbors = True
+
+  __slots__ = ('_zygote', '_collisions', '_definitions', 'candidates', 'name')
+
+  def __init__(self, zygote, candidates):
     self._zygote = zygote
-    self._predecessor = predecessor
     self._collisions = {}
     self.candidates = candidates
     self.name = zygote.name
+    self._index_definitions()
+
+  def _index_definitions(self):
+    """Map shortnames to the first candidate that defines them."""
+    self._definitions = {}
+    for candidate in self.candidates:
+      self._definitions.setdefault(candidate.short(), candidate)
 
   def _detect_collisions(self):
     """Detect candidate collisions and populate `self._collisions`."""
@@ -536,12 +1334,13 @@ class CandidatesWord(DictEq):
         self._collisions[shortname] = winners
 
   def _collect_outbound_pivots(self, world):
-    outbound = self._predecessor.outbound
+    outbound = self._zygote.outbound
     if not outbound: # No outbound references.
       return set()
     takes = self._zygote.takes
     leaves = self._zygote.leaves
     same_as_word_names = set()
+    own = set(self.candidates)
     for reference in outbound:
       reference_strength = reference["strength"]
       reference_same_as = reference["same-as"]
@@ -555,16 +1354,20 @@ class CandidatesWord(DictEq):
       for candidate in referred_to_word.candidates:
         # ... whose short names can be found in this word's effect
         # and which we don't already have ourselves ...
-        if candidate in self.candidates:
+        if candidate in own:
           continue
         if not candidate.prefix_found_in(takes) and not candidate.prefix_found_in(leaves):
           continue
-        # ... make deep copies of them, scale the copies' score according
-        # to outbound ref strength (e.g. same-as > simply outbound).
-        copy = deepcopy(candidate)
-        copy.scale(reference_strength)
+        # ... borrow them, scaling the borrowed score according to
+        # outbound ref strength (e.g. same-as > simply outbound).
+        borrowed = candidate.borrow(reference_strength)
+        STATS.count('candidates borrowed')
         # ... and pretend they're our own candidates.
-        self.candidates.append(copy)
+        own.add(borrowed)
+        self.candidates.append(borrowed)
+        if borrowed.short() not in self._definitions:
+          self._definitions[borrowed.short()] = borrowed
+          world.redefine(borrowed.short(), borrowed)
     # We only actually return only same-as pivots in order to
     # not cause too much of a "domino" reliance.
     return world.get_pivot_set_for_names(same_as_word_names)
@@ -579,20 +1382,22 @@ class CandidatesWord(DictEq):
     return DisambiguatedWord(
       self._zygote.name,
       self._zygote.markdown,
-      self._predecessor.corpus,
-      self._predecessor.primer,
+      self._zygote.html,
+      self._zygote.primer,
       self._zygote.effect,
       self._zygote.takes,
       self._zygote.leaves,
       self._candidates_to_erefs(),
-      self._predecessor.outbound
+      self._zygote.outbound
     )
 
   def define(self, prefix):
     """Return the candidate whose shortname matches `prefix`."""
-    for candidate in self.candidates:
-      if prefix == candidate.short():
-        return candidate
+    return self._definitions.get(prefix)
+
+  def definitions(self):
+    """Return pairs of shortnames and candidates this word defines them as."""
+    return self._definitions.items()
 
   def rewrite(self, world):
     pivots = self._collect_outbound_pivots(world)
@@ -600,55 +1405,67 @@ class CandidatesWord(DictEq):
     self._detect_collisions()
     if not self._collisions:
       return self._to_disamb_word()
+    STATS.count('collisions detected', len(self._collisions))
     # Find more candidates based on 1D gradient for neighbors.
     #
     #        C C C C C C C C C C C
     #          . . . * * * . . .
     #
     # exp(-((x-b)/a)**n), n > 2 is a tabletop (flat top) Gaussian. We
-    # use n = 4, a = 0.1, b is the pivot. This creates a "gradient" with
+    # use n = 4, a = 0.05, b is the pivot. This creates a "gradient" with
     # a flat top at&near pivot, meaning immediate neighbors of pivot are
     # highly favored, farther neighbors less and less so. The gradient
     # decays extremely quickly. AND YES, THIS IS AN OVERKILL.
-    fns = []
+    #
+    # Each pivot only reaches neighbors within `WEIGHT_RADIUS` (farther
+    # ones weigh below the threshold), so only that window of the world
+    # space is weighed, plus one neighbor on each side to be safe. And
+    # for each colliding shortname, only neighbors that define it are,
+    # found through the world's index of definitions.
+    np = lazy('numpy')
+    space = world.space
+    windows = []
     for pivot in pivots:
-      fn = np.vectorize(lambda x: math.exp(-((x-pivot)/0.05)**4), otypes=[np.float64])
-      fns.append(fn)
-    # Apply each function on the world space obtaining a "weight world"
-    # with gradient only for that function. Zero everything out below
-    # a threshold.
-    weight_threshold = 0.05
-    weighed_worlds = []
-    for weigh in fns:
-      weighed_world = weigh(world.space)
-      weighed_worlds.append(np.where(weighed_world < weight_threshold, 0, weighed_world))
-    # Join multiple "weight wolds" each having a tabletop peak,
-    # into one world via addition. Tidy up with min(x, 1) to get
-    # rid of amplification, sort of joining the closely positioned
-    # "tabletops" into a big, long one, raising scores to 1 over
-    # the broad vicinity.
-    weights = FCLAMP(sum(weighed_worlds))
-    resolutions = {} # colliding shortname => {definition: score}
-    for n in np.flatnonzero(weights > weight_threshold):
-      weight = weights[n]
-      if weight < weight_threshold:
+      lo = max(int(np.searchsorted(space, pivot - WEIGHT_RADIUS)) - 1, 0)
+      hi = min(int(np.searchsorted(space, pivot + WEIGHT_RADIUS, side='right')) + 1, len(space))
+      windows.append((pivot, lo, hi))
+    resolutions = [] # (first near offset, colliding shortname, {definition: score})
+    for colliding_shortname in self._collisions:
+      offsets = []
+      scores = []
+      ids = []
+      weights = []
+      for pivot, lo, hi in windows:
+        window_offsets, window_scores, window_ids = world.definitions(colliding_shortname, lo, hi)
+        window_weights = np.exp(-((space[window_offsets] - pivot) / WEIGHT_A) ** WEIGHT_N)
+        # Zero everything out below the threshold.
+        window_weights[window_weights < WEIGHT_THRESHOLD] = 0
+        offsets.append(window_offsets)
+        scores.append(window_scores)
+        ids.append(window_ids)
+        weights.append(window_weights)
+      # Join the windows of all pivots, each having a tabletop peak, via
+      # addition. Tidy up with min(x, 1) to get rid of amplification, sort
+      # of joining the closely positioned "tabletops" into a big, long one,
+      # raising scores to 1 over the broad vicinity.
+      offsets, first, inverse = np.unique(np.concatenate(offsets), return_index=True, return_inverse=True)
+      weights = np.minimum(np.bincount(inverse, np.concatenate(weights), len(offsets)), 1)
+      near = weights > WEIGHT_THRESHOLD
+      if not near.any():
         continue
-      candidate = world.nth(n)
-      for colliding_shortname in self._collisions:
-        # Ask candidate in gradient to define the colliding
-        # shortname.
-        candidate_definition = candidate.define(colliding_shortname)
-        if not candidate_definition:
-          continue
-        weighted_score = candidate_definition.score * weight
-        if colliding_shortname not in resolutions:
-          resolutions[colliding_shortname] = { candidate_definition: weighted_score }
-          continue
-        definitions = resolutions[colliding_shortname] # {definition: score, definition: score, ...}
-        # If there are duplicate definitions we add their weighted scores.
-        previous_score = definitions.get(candidate_definition) or 0
-        definitions[candidate_definition] = previous_score + weighted_score
-    for colliding_shortname, definitions in resolutions.items():
+      # Weigh the score of each neighbor's definition of the colliding
+      # shortname. If there are duplicate definitions we add their
+      # weighted scores, nearest to the start of the world first.
+      ids = np.concatenate(ids)[first][near]
+      weighted = np.concatenate(scores)[first][near] * weights[near]
+      totals = np.bincount(ids, weighted)
+      order, seen = np.unique(ids, return_index=True)
+      resolutions.append((offsets[near][0], colliding_shortname, {
+        world.definition(id): totals[id] for id in order[np.argsort(seen, kind='stable')].tolist()
+      }))
+    # Resolve collisions in the order their nearest definitions are found.
+    resolutions.sort(key=lambda resolution: resolution[0])
+    for _, colliding_shortname, definitions in resolutions:
       likely = sorted(definitions.items(), key=lambda item: item[1], reverse=True)
       min_collision_score = min(candidate.score for candidate in self._collisions[colliding_shortname])
       needle = None
@@ -664,16 +1481,21 @@ class CandidatesWord(DictEq):
         if score <= min_collision_score:
           break
       if needle:
+        STATS.count('collisions resolved')
         self.candidates = [candidate for candidate in self.candidates if candidate == needle or candidate.short() != colliding_shortname]
+        self._index_definitions()
+        world.redefine(colliding_shortname, self._definitions[colliding_shortname])
     return self._to_disamb_word()
 
 
-class DisambiguatedWord(DictEq):
-  def __init__(self, name, markdown, corpus, primer, effect, takes, leaves, erefs, outbound):
+class DisambiguatedWord:
+  __slots__ = ('name', 'effect', 'markdown', 'html', 'primer', 'takes', 'leaves', 'erefs', 'outbound')
+
+  def __init__(self, name, markdown, html, primer, effect, takes, leaves, erefs, outbound):
     self.name = name
     self.effect = effect
     self.markdown = markdown
-    self.corpus = corpus
+    self.html = html
     self.primer = primer
     self.takes = takes
     self.leaves = leaves
@@ -691,17 +1513,17 @@ class DisambiguatedWord(DictEq):
     takes = []
     leaves = []
     for index, effect in enumerate(self.erefs):
-      pattern = f'\\b{re.escape(effect["short"])}\\b'
-      for ordinal, match in enumerate(re.finditer(pattern, self.takes)):
-        takes.append((index, match.start(), ordinal))
-      for ordinal, match in enumerate(re.finditer(pattern, self.leaves)):
-        leaves.append((index, match.start(), ordinal))
+      for ordinal, offset in enumerate(self.takes.offsets(effect["short"])):
+        takes.append((index, offset, ordinal))
+      for ordinal, offset in enumerate(self.leaves.offsets(effect["short"])):
+        leaves.append((index, offset, ordinal))
     takes = [[index, ordinal] for (index, _, ordinal) in sorted(takes, key=lambda x: x[1])]
     leaves = [[index, ordinal] for (index, _, ordinal) in sorted(leaves, key=lambda x: x[1])]
     return {
       "name": self.name,
       "effect": self.effect,
       "markdown": self.markdown,
+      "html": self.html,
       "primer": self.primer,
       "takes": takes,
       "leaves": leaves,
@@ -710,134 +1532,1638 @@ class DisambiguatedWord(DictEq):
     }
 
 
-def advance(generation, names):
+def reads_neighbors(rewritable):
+  """
+  Return whether the stage `rewritable` is at looks at other
+  members of the generation (rather than only at itself).
   """
-  Advance a `generation` of rewritable objects.
+  return getattr(rewritable, 'reads_neighbors', False)
 
-  `names` is an object mapping rewritable objects that have a 'name'
-  attribute, to those objects, to enable one to refer to them by name.
+
+def group_by_stage(generation, indices):
   """
-  modified = False
-  new_names = {}
-  new_generation = []
-  def _add(rewritable):
-    new_generation.append(rewritable)
-    if hasattr(rewritable, 'name'):
-      new_names[rewritable.name] = rewritable
-  for index, rewritable in enumerate(generation):
-    world = World(generation, names, index)
-    if not hasattr(rewritable, 'rewrite'):
-      _add(rewritable)
-      continue
-    rewritten_to = rewritable.rewrite(world)
-    # Node was rewritten to something, therefore, we consider
-    # the entire generation as 'modified'.
-    modified = modified or rewritten_to != rewritable
-    if isinstance(rewritten_to, list):
-      for new_node in new_generation:
-        _add(new_node)
+  Group `indices` of members of `generation` by the stage (class)
+  each member is at. Return a dict mapping stages to indices.
+  """
+  stages = {}
+  for index in indices:
+    stages.setdefault(type(generation[index]), []).append(index)
+  return stages
+
+
+def merge_ranges(ranges):
+  """Return sorted [begin, end) `ranges`, with overlapping ones merged."""
+  merged = []
+  for begin, end in sorted(ranges):
+    if merged and begin <= merged[-1][1]:
+      merged[-1][1] = max(merged[-1][1], end)
+    else:
+      merged.append([begin, end])
+  return merged
+
+
+def replay(world, indices, base):
+  """
+  Make members of `world` at `indices` cross the barrier as if
+  the whole generation did. Return a dict mapping offsets of
+  members that had to cross it to what they were rewritten to.
+
+  A member crossing the barrier sees members to its left as
+  already rewritten, and members to its right as not yet
+  rewritten. Here, all members are obtained on demand instead:
+  `base(n)` must return a fresh copy of the `n`th member as
+  it was when it reached the barrier. Members to the left are
+  made to cross the barrier (recursively) when first seen.
+  """
+  np = lazy('numpy')
+  pristine = {}
+  crossed = {}
+  rewritten = {}
+  # What members define is indexed as they are materialized, both as
+  # they are before crossing the barrier and after (see `World.definitions`).
+  pristine_index = DefinitionIndex(world)
+  crossed_index = DefinitionIndex(world)
+  is_pristine = np.zeros(len(world.space), dtype=bool)
+  is_crossed = np.zeros(len(world.space), dtype=bool)
+  def _lookup(reader, n):
+    if n < reader:
+      return _cross(n)
+    return _pristine(n)
+  def _pristine(n):
+    if n not in pristine:
+      pristine[n] = base(n)
+      pristine_index.add(n, pristine[n])
+      is_pristine[n] = True
+    return pristine[n]
+  def _cross(n):
+    if n not in crossed:
+      member = base(n)
+      rewritten[n] = member.rewrite(ReplayView(world, n, member, _lookup, _definitions))
+      crossed[n] = member
+      crossed_index.add(n, member)
+      is_crossed[n] = True
+    return crossed[n]
+  def _materialize(fetch, materialized, begin, end):
+    for n in (np.flatnonzero(~materialized[begin:end]) + begin).tolist():
+      fetch(n)
+  def _definitions(reader, shortname, begin, end):
+    _materialize(_cross, is_crossed, begin, min(end, reader))
+    _materialize(_pristine, is_pristine, max(begin, reader + 1), end)
+    left = crossed_index.lookup(shortname, begin, min(end, reader))
+    right = pristine_index.lookup(shortname, max(begin, reader + 1), end)
+    return tuple(np.concatenate(columns) for columns in zip(left, right))
+  for index in indices:
+    _cross(index)
+  return rewritten
+
+
+WORKER_KNOWN = None
+
+
+def init_worker(known, snapshot=None):
+  """
+  Initialize a worker process: remember the set of `known` word
+  names, and load NLTK models (from the models `snapshot`, if
+  any) once for all chunks the worker is going to rewrite.
+  """
+  global WORKER_KNOWN, MODELS_SNAPSHOT
+  WORKER_KNOWN = known
+  MODELS_SNAPSHOT = snapshot
+  get_sent_tokenizer()
+  get_word_tokenizer()
+  get_tagger()
+
+
+def rewrite_chunk(chunk, names, known=None):
+  """
+  Rewrite a `chunk` of a generation in a worker process, up to
+  the first barrier. Unless `known` is given, the worker's set of
+  known names is used. Return a tuple of the rewritten chunk and
+  answers its members got from `World.is_word`, by offset.
+  """
+  world = rewrite(chunk, names, known=WORKER_KNOWN if known is None else known, stop_at_barrier=True)
+  return chunk, world.answers
+
+
+# Pool of worker processes the server keeps between requests, so
+# that they load models only once (see `serve`).
+WORKER_POOL = None
+
+
+@contextlib.contextmanager
+def worker_pool(jobs, known):
+  """
+  Yield a tuple of a pool of `jobs` worker processes, or None if
+  `jobs` is one, and the set of known names to give `rewrite_chunk`.
+  The latter is None if the pool was made knowing of `known` word
+  names, and `known` if the pool is the `WORKER_POOL`, made before
+  any names were known.
+  """
+  if jobs <= 1:
+    yield None, None
+  elif WORKER_POOL is not None:
+    yield WORKER_POOL, known
+  else:
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(known, MODELS_SNAPSHOT)) as pool:
+      yield pool, None
+
+
+def rewrite_in_pool(generation, names, indices, jobs):
+  """
+  Rewrite members of `generation` at `indices` up to the first
+  barrier on a pool of `jobs` processes.
+  """
+  chunksize = max(1, math.ceil(len(indices) / (jobs * 4)))
+  chunks = [indices[start:start + chunksize] for start in range(0, len(indices), chunksize)]
+  with worker_pool(jobs, frozenset(name for name in names if name is not None)) as (pool, known):
+    futures = [
+      pool.submit(rewrite_chunk, [generation[index] for index in chunk], [names[index] for index in chunk], known)
+      for chunk in chunks
+    ]
+    for chunk, future in zip(chunks, futures):
+      for index, rewritten_to in zip(chunk, future.result()[0]):
+        generation[index] = rewritten_to
+
+
+def rewrite(generation, names, jobs=1, known=None, stop_at_barrier=False):
+  """
+  Rewrite a `generation` of rewritable objects in place until
+  none of them can be rewritten any further. `names` lists the
+  names of objects in the generation (None for nameless ones),
+  in order.
+
+  Only objects with a pending stage (i.e. those that have a
+  'rewrite' attribute) are kept on the worklist; objects that
+  reached their final form are never visited again. An object
+  also settles if it rewrites to itself.
+
+  Stages that have a `rewrite_all` method rewrite all objects
+  at that stage in one call, e.g. to batch expensive work.
+
+  Stages that `reads_neighbors` act as barriers. Objects at
+  such a stage wait until every other object on the worklist
+  had caught up with them. They are then all rewritten against
+  the same generation, and their results are committed only
+  after the last one of them had run. If `stop_at_barrier` is
+  true, rewriting stops when all pending objects reached a
+  barrier instead.
+
+  Stages before the first barrier only look at the object itself
+  (and at the names of `known` words, see `World`). With `jobs`
+  greater than one, they run on a pool of that many processes.
+
+  Time spent in each stage and round is recorded in `STATS`.
+
+  Return the world the generation was rewritten in.
+  """
+  world = World(generation, names, known)
+  worklist = [index for index, rewritable in enumerate(generation) if hasattr(rewritable, 'rewrite')]
+  local = [index for index in worklist if not reads_neighbors(generation[index])]
+  if jobs > 1 and local:
+    with STATS.stage('pool', len(local)):
+      rewrite_in_pool(generation, names, local, jobs)
+    worklist = [index for index in worklist if hasattr(generation[index], 'rewrite')]
+  while worklist:
+    ready = [index for index in worklist if not reads_neighbors(generation[index])]
+    barrier = not ready
+    if barrier and stop_at_barrier:
+      break
+    if barrier:
+      # Everyone is waiting at a barrier, so cross it together.
+      ready = worklist
+    STATS.begin_round(barrier)
+    staged = []
+    settled = set()
+    transitioned = 0
+    for stage, indices in group_by_stage(generation, ready).items():
+      rewritables = [generation[index] for index in indices]
+      worlds = [world.at(index) for index in indices]
+      with STATS.stage(stage.__name__, len(indices)):
+        if hasattr(stage, 'rewrite_all'):
+          rewritten = stage.rewrite_all(rewritables, worlds)
+        else:
+          rewritten = [rewritable.rewrite(world) for rewritable, world in zip(rewritables, worlds)]
+      for index, rewritable, rewritten_to in zip(indices, rewritables, rewritten):
+        if rewritten_to is rewritable or not hasattr(rewritten_to, 'rewrite'):
+          settled.add(index)
+        if rewritten_to is not rewritable:
+          transitioned += 1
+        if barrier:
+          staged.append((index, rewritten_to))
+        else:
+          generation[index] = rewritten_to
+    for index, rewritten_to in staged:
+      generation[index] = rewritten_to
+    worklist = [index for index in worklist if index not in settled]
+    STATS.end_round(transitioned)
+  return world
+
+
+def referenced_names(desc, known):
+  """
+  Return a sorted list of names of `known` words that `desc`
+  may refer to, i.e., those found in it delimited by whitespace
+  and/or backticks.
+  """
+  names = set()
+  for chunk in desc.split():
+    for piece in (chunk, chunk.strip('`'), *chunk.split('`')):
+      if piece in known:
+        names.add(piece)
+  return sorted(names)
+
+
+class Cache:
+  """
+  A persistent, content-addressed cache of words rewritten up to
+  the first barrier, that is, with their markdown rendered, and
+  corpus tokenized and POS-tagged. Backed by an SQLite database
+  in a cache directory.
+
+  Entries are keyed by the word's name and description, names of
+  known words it refers to, and versions of NLTK, mistune and of
+  this script. Entries not used for `max_age` seconds, and the
+  least recently used ones above `max_size` bytes, are evicted
+  on `save` (and `close`).
+  """
+
+  def __init__(self, directory, max_size=256 * 2**20, max_age=30 * 24 * 3600):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    self._db = sqlite3.connect(directory / 'nkdoc.sqlite3')
+    self._db.execute('CREATE TABLE IF NOT EXISTS words (key TEXT PRIMARY KEY, value BLOB, size INTEGER, atime REAL)')
+    self._max_size = max_size
+    self._max_age = max_age
+    self._used = []
+    version = hashlib.sha256(Path(__file__).read_bytes())
+    version.update(version_of('nltk').encode())
+    version.update(version_of('mistune').encode())
+    # Entries are pickles, which refer to classes by module: that is
+    # "__main__" when this script is run, and "nkdoc" when imported.
+    version.update(f'{__name__}\0pickle-{pickle.HIGHEST_PROTOCOL}'.encode())
+    self._version = version.digest()
+
+  def key(self, obj, known):
+    """
+    Return the cache key for word JSON object `obj`, given the
+    set of `known` word names.
+    """
+    key = hashlib.sha256(self._version)
+    for datum in (obj["name"], obj["desc"], *referenced_names(obj["desc"], known)):
+      key.update(datum.encode())
+      key.update(b'\0')
+    return key.hexdigest()
+
+  def get(self, key):
+    """
+    Return the word cached under `key`, or None. Entries that can't
+    be unpickled count as missing, and are replaced on `put`.
+    """
+    row = self._db.execute('SELECT value FROM words WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      return None
+    try:
+      rewritable = pickle.loads(row[0])
+    except (pickle.UnpicklingError, AttributeError, EOFError, ImportError):
+      return None
+    self._used.append(key)
+    return rewritable
+
+  def put(self, key, rewritable):
+    """Cache `rewritable` under `key`."""
+    value = pickle.dumps(rewritable, pickle.HIGHEST_PROTOCOL)
+    self._db.execute('INSERT OR REPLACE INTO words VALUES (?, ?, ?, ?)', (key, value, len(value), time.time()))
+
+  def save(self):
+    """Evict stale entries and save the cache."""
+    now = time.time()
+    self._db.executemany('UPDATE words SET atime = ? WHERE key = ?', ((now, key) for key in self._used))
+    self._used.clear()
+    self._db.execute('DELETE FROM words WHERE atime < ?', (now - self._max_age,))
+    total = 0
+    evicted = []
+    for key, size in self._db.execute('SELECT key, size FROM words ORDER BY atime DESC'):
+      total += size
+      if total > self._max_size:
+        evicted.append((key,))
+    self._db.executemany('DELETE FROM words WHERE key = ?', evicted)
+    self._db.commit()
+
+  def close(self):
+    """Save and close the cache."""
+    self.save()
+    self._db.close()
+
+
+def digest(obj):
+  """Return a short digest of word JSON object `obj`."""
+  return hashlib.blake2b(f'{obj["name"]}\0{obj["desc"]}'.encode(), digest_size=8).hexdigest()
+
+
+def to_payload(words, html=False):
+  """
+  Convert a list of fully rewritten `words` (dicts) to compact-ish
+  payload JSON object. HTML of words is kept if `html` is true,
+  with links to words by index (see `link_html`).
+  """
+  # Owners and outbound refs may point forward, so all indices
+  # must be known before the sweep below.
+  word_to_index = {word["name"]: index for index, word in enumerate(words)}
+  effect_id_to_index = {}
+  effects = []
+
+  for index, word in enumerate(words):
+    erefs = []
+    for effect_ref in word["erefs"]:
+      # Based on effect references in words, we create an effects
+      # pool and populate it with effect objects. Words add their
+      # indices to effect objects they happen to reference, and
+      # replace the effect ref object by the index of the effect
+      # in the effects array, and the index of the owner word.
+      short = effect_ref["short"]
+      long = effect_ref["long"]
+      effect_id = (short, long)
+      effect_index = effect_id_to_index.get(effect_id)
+      if effect_index is None:
+        effect_id_to_index[effect_id] = effect_index = len(effects)
+        effects.append({ "short": short, "long": long, "words": [] })
+      effects[effect_index]["words"].append(index)
+      erefs.append([effect_index, word_to_index[effect_ref["owner"]]])
+    word["erefs"] = erefs
+    # Replace "outbound" refs in words with their indices to
+    # save space.
+    word["outbound"] = [word_to_index[ref["name"]] for ref in word["outbound"]]
+    if html:
+      word["html"] = link_html(word["html"], word_to_index)
     else:
-      _add(rewritten_to)
-  return modified, new_generation, new_names
-
-
-# Form an array of WordObject instances from the words JSON.
-# The architecture is a rewriting one, so we have to start from
-# somewhere -- and here we start from WordObject-s.
-
-uwords = []
-unames = {}
-raw = sys.stdin.read()
-root = json.loads(raw)
-words = root["words"]
-for name, word in words.items():
-  uword = WordObject(word)
-  unames[name] = uword
-  uwords.append(uword)
-
-
-# Begin rewriting. From this point onwards, nodes themselves decide what
-# they're going to be. We're only giving them a "world" to live in and
-# advancing this world until everything comes at a standstill.
-
-generation = uwords
-names = unames
-
-progress = sys.stdout.isatty()
-
-n = 0
-while True:
-  if progress:
-    print(f'[INFO] Rewriting round #{n}')
-  modified, new_generation, new_names = advance(generation, names)
-  if not modified:
-    break
-  generation = new_generation
-  names = new_names
-  n += 1
-
-# Convert the rewritten generation to compact-ish JSON.
-
-words = generation
-word_to_index = {}
-effect_id_to_effect = {}
-
-# CREATE WORDS ARRAY
-
-for index, word in enumerate(words):
-  word_to_index[word["name"]] = index
-  for effect_ref in word["erefs"]:
-    # Based on effect references in words, we create an effects
-    # hash (effects pool) and populate it with effect objects.
-    # Words also add their indices to effect objects they happen
-    # to reference.
-    effect_id = (effect_ref["short"], effect_ref["long"])
-    if effect_id in effect_id_to_effect:
-      effect = effect_id_to_effect[effect_id]
+      del word["html"]
+
+  return { "words": words, "effects": effects }
+
+
+def same_as_of(words):
+  """
+  Return same-as refs of fully rewritten `words` (dicts), before
+  `to_payload` drops them, as a list of pairs of the index of a
+  word and indices of words it is the same as.
+  """
+  word_to_index = {word["name"]: index for index, word in enumerate(words)}
+  same_as = []
+  for index, word in enumerate(words):
+    targets = sorted(word_to_index[ref["name"]] for ref in word["outbound"] if ref["same-as"])
+    if targets:
+      same_as.append([index, targets])
+  return same_as
+
+
+STREAM_BATCH_SIZE = 128
+
+
+def checked_word(obj):
+  """
+  Return word JSON object `obj` as is, or raise ValueError if it
+  isn't one, i.e., doesn't have a string "name" and "desc".
+  """
+  if not isinstance(obj, dict) or not isinstance(obj.get("name"), str) or not isinstance(obj.get("desc"), str):
+    raise ValueError(f'Not a word object with string "name" and "desc": {json.dumps(obj)[:80]}')
+  return obj
+
+
+def records(lines):
+  """
+  Yield word JSON objects from newline-delimited JSON `lines`,
+  skipping blank ones. Raises ValueError on objects that aren't
+  word objects (see `checked_word`).
+  """
+  for line in lines:
+    if line.strip():
+      yield checked_word(json.loads(line))
+
+
+def stream(lines, cache=None, jobs=1, batch_size=STREAM_BATCH_SIZE):
+  """
+  Read word JSON objects from newline-delimited JSON `lines`, and
+  rewrite them up to the first barrier in batches as they arrive,
+  on a pool of `jobs` processes if it's greater than one.
+
+  Until the end of input, a word doesn't know of the words that
+  follow it. Per-word stages only ask whether names in code spans
+  are names of words (see `World.is_word`), so a word is kept if
+  the answers are the same at the end of input as they were when
+  it was rewritten, and is left for `build` to rewrite otherwise.
+  Words found in the cache are kept if the known words they may
+  refer to (see `referenced_names`), which their key is made of,
+  are the same.
+
+  Return a tuple of the words dict (see `build`) and the list of
+  words rewritten up to the first barrier, in the same order,
+  with None for words left for `build`.
+  """
+  words = {}
+  batch = []
+  batches = []
+  def _flush():
+    objs = [words[name] for name in dict.fromkeys(batch)]
+    batch.clear()
+    refs = [referenced_names(obj["desc"], words) for obj in objs]
+    keys = [cache.key(obj, words) for obj in objs] if cache else [None] * len(objs)
+    generation = [(cache.get(key) if cache else None) or WordObject(obj) for obj, key in zip(objs, keys)]
+    misses = [isinstance(rewritable, WordObject) for rewritable in generation]
+    names = [obj["name"] for obj in objs]
+    # Per-word stages only ask about names the word refers to.
+    known = frozenset(itertools.chain.from_iterable(refs))
+    if pool:
+      # Batches are split across all workers, or small inputs would
+      # only keep a few of them busy.
+      size = math.ceil(len(objs) / jobs)
+      parts = [
+        pool.submit(rewrite_chunk, generation[start:start + size], names[start:start + size], known)
+        for start in range(0, len(objs), size)
+      ]
     else:
-      effect_id_to_effect[effect_id] = effect = {
-        "short": effect_ref["short"],
-        "long": effect_ref["long"],
-        "words": []
-      }
-    effect["words"].append(index)
-
-# Replace "outbound" refs in words with their indices to
-# save space. We weren't able to do that above because
-# not all indices are known at that time.
-for word in words:
-  word["outbound"] = [word_to_index[ref["name"]] for ref in word["outbound"]]
-
-# CREATE EFFECTS ARRAY
-
-effects = effect_id_to_effect.values()
-
-for pivot_index, pivot_effect in enumerate(effects):
-  pivot_short = pivot_effect["short"]
-  pivot_long = pivot_effect["long"]
-  # Go through all words the pivot effect is referred by. In
-  # each such word, replace the corresponding effect ref object
-  # by the index of the pivot effect in the effects array, and
-  # the index of the owner word.
-  for word_index in pivot_effect["words"]:
-    word = words[word_index]
-    old_erefs = word["erefs"]
-    new_erefs = []
-    for old_eref in old_erefs:
-      if not isinstance(old_eref, dict):
-        # Uhmm it's something else, not dict. Not gonna touch it.
-        new_erefs.append(old_eref)
+      parts = [rewrite_chunk(generation, names, known)]
+    batches.append((objs, refs, keys, misses, parts))
+  # Batches are each rewritten knowing of the names they refer to.
+  with worker_pool(jobs, frozenset()) as (pool, _):
+    for obj in records(lines):
+      words[obj["name"]] = obj
+      batch.append(obj["name"])
+      if len(batch) >= batch_size:
+        _flush()
+    if batch:
+      _flush()
+    rewritten = {}
+    for objs, refs, keys, misses, parts in batches:
+      generation = []
+      answers = {}
+      for part in parts:
+        chunk, chunk_answers = part.result() if pool else part
+        answers.update((len(generation) + offset, answer) for offset, answer in chunk_answers.items())
+        generation.extend(chunk)
+      for offset, (obj, ref, key, miss, rewritable) in enumerate(zip(objs, refs, keys, misses, generation)):
+        # A later record of the same word wins, as it would in a dict.
+        if words[obj["name"]] is not obj:
+          rewritten.pop(obj["name"], None)
+          continue
+        if miss:
+          current = all((name in words) == answer for name, answer in answers.get(offset, {}).items())
+        else:
+          current = ref == referenced_names(obj["desc"], words)
+        if not current:
+          rewritten.pop(obj["name"], None)
+          continue
+        if cache and miss:
+          cache.put(key, rewritable)
+        rewritten[obj["name"]] = rewritable
+  return words, [rewritten.get(name) for name in words]
+
+
+RE_NAME_SPLIT = re.compile(r'(?<!^)(?=[A-Z])|[_-]|\W+')
+RE_FENCED_CODE = re.compile(r'```.*?(?:```|$)', re.DOTALL)
+RE_SEARCH_TERM = re.compile(r'\w+')
+
+# Terms too common to be worth searching for.
+STOPWORDS = frozenset((
+  'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'if', 'in',
+  'is', 'it', 'its', 'of', 'on', 'or', 'so', 'that', 'the', 'this', 'to', 'with',
+))
+
+
+def name_pieces(name):
+  """
+  Return lowercase pieces of word `name`, split where `RE_PIECEWORD`
+  would find a piece ("appendEcho" into "append" and "echo"), and
+  on punctuation.
+  """
+  return [piece.lower() for piece in RE_NAME_SPLIT.split(name) if piece]
+
+
+def text_terms(text):
+  """Return lowercase terms of `text`, except for stopwords."""
+  return [
+    term for term in (match.lower() for match in RE_SEARCH_TERM.findall(text))
+    if len(term) > 1 and term not in STOPWORDS
+  ]
+
+
+def trigrams(name):
+  """Return trigrams of lowercase word `name`, padded with a space on each side."""
+  padded = f' {name.lower()} '
+  return [padded[n:n + 3] for n in range(len(padded) - 2)]
+
+
+def inverted_index(terms_of):
+  """
+  Build an inverted index from `terms_of`, a list of iterables of
+  terms of each word. Return it as a sorted list of "terms", and
+  their "postings": sorted indices of words with each term, packed
+  by `pack_lists`.
+  """
+  postings = {}
+  for index, terms in enumerate(terms_of):
+    for term in set(terms):
+      postings.setdefault(term, []).append(index)
+  terms = sorted(postings)
+  return { "terms": terms, "postings": pack_lists(postings[term] for term in terms) }
+
+
+def search_index(payload, build_info):
+  """
+  Return the search index of `payload`: inverted indices of name
+  pieces, of terms in primers and markdowns (except code blocks),
+  and of terms in long names of the effects words refer to; and an
+  inverted index of name trigrams, for fuzzy lookup of names.
+  """
+  words = payload["words"]
+  effects = payload["effects"]
+  return {
+    "names": inverted_index([[word["name"].lower(), *name_pieces(word["name"])] for word in words]),
+    "text": inverted_index([
+      text_terms(word["primer"] + ' ' + RE_FENCED_CODE.sub(' ', word["markdown"]))
+      for word in words
+    ]),
+    "effects": inverted_index([
+      [term for effect_index, _ in word["erefs"] for term in text_terms(effects[effect_index]["long"])]
+      for word in words
+    ]),
+    "trigrams": inverted_index([trigrams(word["name"]) for word in words]),
+  }
+
+
+def signature_index(payload, build_info):
+  """
+  Return the signature index of `payload`, for looking words up
+  by what they take and leave: indices of words that take, and
+  that leave each effect (by effect id); and inverted indices of
+  words by their signature (e.g. "3 1 -- 4", ids of effects taken
+  and left, in order), and by their arity (e.g. "2 -- 1"). Only
+  effects resolved to effect ids count.
+  """
+  words = payload["words"]
+  effects = payload["effects"]
+  takers = [[] for _ in effects]
+  leavers = [[] for _ in effects]
+  signatures = []
+  arities = []
+  for index, word in enumerate(words):
+    erefs = word["erefs"]
+    takes = [erefs[eref_index][0] for eref_index, _ in word["takes"]]
+    leaves = [erefs[eref_index][0] for eref_index, _ in word["leaves"]]
+    for effect_index in set(takes):
+      takers[effect_index].append(index)
+    for effect_index in set(leaves):
+      leavers[effect_index].append(index)
+    signatures.append([' '.join(map(str, [*takes, '--', *leaves]))])
+    arities.append([f'{len(takes)} -- {len(leaves)}'])
+  return {
+    "takes": pack_lists(takers),
+    "leaves": pack_lists(leavers),
+    "signatures": inverted_index(signatures),
+    "arities": inverted_index(arities),
+  }
+
+
+# How many related words `graph_index` lists per word, at most.
+RELATED_SIZE = 8
+
+
+def graph_index(payload, build_info):
+  """
+  Return the cross-reference graph of `payload`: indices of words
+  that refer to each word (by outbound ref); connected components
+  of words that are the same as each other (by same-as refs in
+  `build_info`), ignoring direction, and the component of each
+  word (-1 if it's alone); and up to `RELATED_SIZE` related words
+  per word, most related first.
+  """
+  words = payload["words"]
+  same_as = build_info["same_as"]
+  inbound = [[] for _ in words]
+  for index, word in enumerate(words):
+    for n in word["outbound"]:
+      inbound[n].append(index)
+  # Union-find over same-as refs, with path halving.
+  parents = list(range(len(words)))
+  def _find(n):
+    while parents[n] != n:
+      parents[n] = n = parents[parents[n]]
+    return n
+  for index, targets in same_as:
+    for n in targets:
+      a, b = _find(index), _find(n)
+      if a != b:
+        parents[max(a, b)] = min(a, b)
+  members = collections.defaultdict(list)
+  for index in range(len(words)):
+    members[_find(index)].append(index)
+  components = [group for _, group in sorted(members.items()) if len(group) > 1]
+  component_of = [-1] * len(words)
+  for component_index, group in enumerate(components):
+    for index in group:
+      component_of[index] = component_index
+  # Rank related words the way outbound refs are weighed: a same-as
+  # ref either way is strongest, then being in the same component,
+  # then a plain ref either way. Components are bounded, too, since
+  # only the first few of their members can make it in.
+  direct = collections.defaultdict(set)
+  for index, targets in same_as:
+    for n in targets:
+      direct[index].add(n)
+      direct[n].add(index)
+  related = []
+  for index, word in enumerate(words):
+    scores = collections.Counter()
+    for n in word["outbound"]:
+      scores[n] += 0.5
+    for n in inbound[index]:
+      scores[n] += 0.5
+    for n in direct[index]:
+      scores[n] += 1
+    if component_of[index] >= 0:
+      for n in components[component_of[index]][:RELATED_SIZE + 1]:
+        scores[n] += 0.75
+    scores.pop(index, None)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    related.append([n for n, _ in ranked[:RELATED_SIZE]])
+  return {
+    "inbound": pack_lists(inbound),
+    "components": pack_lists(components),
+    "component_of": component_of,
+    "related": pack_lists(related),
+  }
+
+
+# Indices that can be added to the payload, see `index_payload`.
+# Indexers are given the payload and its build info (see `build`).
+INDEXERS = {
+  'search': search_index,
+  'signature': signature_index,
+  'graph': graph_index,
+}
+
+
+def index_payload(payload, build_info, kinds):
+  """
+  Add indices of the given `kinds` (see `INDEXERS`) to `payload`,
+  under "index". Indices refer to words and effects by their
+  indices in `payload`.
+  """
+  if kinds:
+    payload["index"] = {kind: INDEXERS[kind](payload, build_info) for kind in kinds}
+  return payload
+
+
+# Fields of words that hold strings, and lists of integers (or of
+# pairs of integers), in the columnar payload. Primers are mostly
+# the first sentence of the markdown, so they're stored separately.
+WORD_STRING_FIELDS = ("name", "effect", "markdown")
+WORD_LIST_FIELDS = ("takes", "leaves", "erefs", "outbound")
+
+
+def utf16_length(string):
+  """Return the length of `string` in UTF-16 code units, as in JavaScript."""
+  return len(string.encode('utf-16-le')) // 2
+
+
+def utf16_prefix(string, length):
+  """Return the prefix of `string` that is `length` UTF-16 code units long."""
+  return string.encode('utf-16-le')[:length * 2].decode('utf-16-le')
+
+
+def pack_lists(lists):
+  """
+  Pack `lists` of integers, or of lists of integers (e.g. pairs),
+  into a column: one flat list of integers, "values", and a list
+  of "offsets" into it such that values of the n-th list are
+  between `offsets[n]` and `offsets[n + 1]`.
+  """
+  offsets = [0]
+  values = []
+  for items in lists:
+    for item in items:
+      if isinstance(item, list):
+        values.extend(item)
+      else:
+        values.append(item)
+    offsets.append(len(values))
+  return { "offsets": offsets, "values": values }
+
+
+def unpack_lists(column, width=1):
+  """
+  Unpack a `column` made by `pack_lists`. If `width` is greater
+  than one, values are grouped into lists of that many.
+  """
+  offsets = column["offsets"]
+  values = column["values"]
+  lists = []
+  for start, end in zip(offsets, offsets[1:]):
+    if width == 1:
+      lists.append(values[start:end])
+    else:
+      lists.append([values[n:n + width] for n in range(start, end, width)])
+  return lists
+
+
+def to_columnar(payload):
+  """
+  Convert `payload` (see `to_payload`) to the columnar format:
+  all strings are stored once in a string table, and referred to
+  by their indices in it. Fields of words and effects are stored
+  in columns rather than in objects, with lists packed by
+  `pack_lists`. Takes, leaves and erefs are lists of pairs, and
+  are flattened.
+
+  A primer that is a prefix of the word's markdown is stored as
+  its length (in UTF-16 code units, for the frontend to `slice`),
+  and any other primer as `-1 - n`, where `n` is its index in the
+  string table. HTML of words, if any, is stored like markdown.
+  """
+  strings = []
+  string_ids = {}
+  def _intern(string):
+    string_id = string_ids.get(string)
+    if string_id is None:
+      string_ids[string] = string_id = len(strings)
+      strings.append(string)
+    return string_id
+  words = payload["words"]
+  effects = payload["effects"]
+  # Intern strings word by word, so that similar strings (e.g. the
+  # markdown and the primer, which is usually its first sentence)
+  # end up close to each other, where compressors can find them.
+  string_fields = WORD_STRING_FIELDS
+  if words and "html" in words[0]:
+    string_fields += ("html",)
+  string_columns = {field: [] for field in string_fields}
+  primers = []
+  for word in words:
+    for field in string_fields:
+      string_columns[field].append(_intern(word[field]))
+    primer = word["primer"]
+    if word["markdown"].startswith(primer):
+      primers.append(utf16_length(primer))
+    else:
+      primers.append(-1 - _intern(primer))
+  columnar = {
+    "format": "columnar",
+    "words": {
+      **string_columns,
+      "primer": primers,
+      **{field: pack_lists(word[field] for word in words) for field in WORD_LIST_FIELDS},
+    },
+    "effects": {
+      "short": [_intern(effect["short"]) for effect in effects],
+      "long": [_intern(effect["long"]) for effect in effects],
+      "words": pack_lists(effect["words"] for effect in effects),
+    },
+    "strings": strings,
+  }
+  if "index" in payload:
+    columnar["index"] = payload["index"]
+  return columnar
+
+
+def from_columnar(columnar):
+  """Convert `columnar` payload back to the usual payload format."""
+  strings = columnar["strings"]
+  words = columnar["words"]
+  effects = columnar["effects"]
+  string_fields = WORD_STRING_FIELDS + (("html",) if "html" in words else ())
+  fields = {field: [strings[n] for n in words[field]] for field in string_fields}
+  fields["primer"] = [
+    utf16_prefix(markdown, primer) if primer >= 0 else strings[-1 - primer]
+    for markdown, primer in zip(fields["markdown"], words["primer"])
+  ]
+  fields.update({field: unpack_lists(words[field], 1 if field == "outbound" else 2) for field in WORD_LIST_FIELDS})
+  payload = {
+    "words": [
+      {field: fields[field][n] for field in (*string_fields, "primer", *WORD_LIST_FIELDS)}
+      for n in range(len(words["name"]))
+    ],
+    "effects": [
+      { "short": strings[short], "long": strings[long], "words": effect_words }
+      for short, long, effect_words in zip(effects["short"], effects["long"], unpack_lists(effects["words"]))
+    ],
+  }
+  if "index" in columnar:
+    payload["index"] = columnar["index"]
+  return payload
+
+
+def encode_payload(payload, format='json'):
+  """Return `payload` encoded as JSON, in the given `format`."""
+  if format == 'columnar':
+    payload = to_columnar(payload)
+  return json.dumps(payload, separators=(',', ':'))
+
+
+@functools.cache
+def get_brotli():
+  """Return the brotli module, or None if it isn't installed."""
+  try:
+    return lazy('brotli')
+  except ImportError:
+    print('[WARN] Brotli is not installed, not writing .br files', file=sys.stderr)
+    return None
+
+
+def precompress(path, data):
+  """
+  Write gzip- and brotli-compressed `data` (bytes) next to `path`,
+  for web servers to serve as is. Brotli is optional.
+  """
+  Path(f'{path}.gz').write_bytes(gzip.compress(data, 9, mtime=0))
+  if brotli := get_brotli():
+    Path(f'{path}.br').write_bytes(brotli.compress(data))
+
+
+def namespace_of(name):
+  """
+  Return the namespace of word `name`, e.g. "entry" for "entry:fetch",
+  or '' if it has none. Trailing colons (as in "sliceAt:") don't
+  count.
+  """
+  head, colon, tail = name.partition(':')
+  return head if head and colon and tail else ''
+
+
+def shard_payload(payload, by='namespace', size=None):
+  """
+  Split `payload` into shards of words: one per namespace if `by`
+  is 'namespace', or all in one otherwise, split further so that
+  none has more than `size` words, if given. Effects go to the
+  shard of the first word that refers to them.
+
+  Indices in words and effects stay global, i.e., the same as
+  in `payload`, so that they can be resolved across shards using
+  the manifest. Return a tuple of the manifest and the list of
+  shards.
+  """
+  words = payload["words"]
+  effects = payload["effects"]
+  groups = {}
+  for index, word in enumerate(words):
+    key = namespace_of(word["name"]) if by == 'namespace' else ''
+    groups.setdefault(key, []).append(index)
+  shards = []
+  manifest = {
+    "format": "sharded",
+    "names": [word["name"] for word in words],
+    "word_shards": [0] * len(words),
+    "effect_shards": [],
+    "shards": [],
+  }
+  for namespace, indices in groups.items():
+    step = size or len(indices)
+    for start in range(0, len(indices), step):
+      shard = { "word_indices": indices[start:start + step], "words": [], "effect_indices": [], "effects": [] }
+      for index in shard["word_indices"]:
+        manifest["word_shards"][index] = len(shards)
+        shard["words"].append(words[index])
+      manifest["shards"].append({ "file": f'shard-{len(shards)}.json', "namespace": namespace, "words": len(shard["words"]) })
+      shards.append(shard)
+  for index, effect in enumerate(effects):
+    shard = manifest["word_shards"][effect["words"][0]]
+    manifest["effect_shards"].append(shard)
+    shards[shard]["effect_indices"].append(index)
+    shards[shard]["effects"].append(effect)
+  return manifest, shards
+
+
+def write_shards(directory, payload, by='namespace', size=None, compress=False):
+  """
+  Write `payload` split into shards (see `shard_payload`) to
+  `directory`: the manifest to "manifest.json", shards to files
+  the manifest lists, and indices, if any, to "index.json".
+  If `compress` is true, also write precompressed files.
+
+  Files an earlier run wrote to `directory` are removed first.
+  """
+  directory = Path(directory)
+  directory.mkdir(parents=True, exist_ok=True)
+  # Otherwise shards past the ones written now, or indices and
+  # compressed manifests that aren't written now, would be left
+  # behind.
+  stale = ["manifest.json", "index.json"]
+  if (old := directory / "manifest.json").exists():
+    stale.extend(entry["file"] for entry in json.loads(old.read_text())["shards"])
+  for name in stale:
+    for suffix in ('', '.gz', '.br'):
+      (directory / f'{name}{suffix}').unlink(missing_ok=True)
+  manifest, shards = shard_payload(payload, by, size)
+  files = [("manifest.json", manifest)]
+  files.extend((entry["file"], shard) for entry, shard in zip(manifest["shards"], shards))
+  if "index" in payload:
+    files.append(("index.json", payload["index"]))
+  for name, obj in files:
+    path = directory / name
+    data = json.dumps(obj, separators=(',', ':')).encode()
+    path.write_bytes(data)
+    if compress:
+      precompress(path, data)
+
+
+def read_shards(directory):
+  """Read the payload written to `directory` by `write_shards`."""
+  directory = Path(directory)
+  manifest = json.loads((directory / "manifest.json").read_text())
+  payload = {
+    "words": [None] * len(manifest["names"]),
+    "effects": [None] * len(manifest["effect_shards"]),
+  }
+  for entry in manifest["shards"]:
+    shard = json.loads((directory / entry["file"]).read_text())
+    for index, word in zip(shard["word_indices"], shard["words"]):
+      payload["words"][index] = word
+    for index, effect in zip(shard["effect_indices"], shard["effects"]):
+      payload["effects"][index] = effect
+  if (path := directory / "index.json").exists():
+    payload["index"] = json.loads(path.read_text())
+  return payload
+
+
+def payload_digest(payload):
+  """Return a short digest of words and effects of `payload`."""
+  data = json.dumps([payload["words"], payload["effects"]], separators=(',', ':'), sort_keys=True)
+  return hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+
+def stable_words(payload):
+  """
+  Return words of `payload` keyed by their names, with effects
+  and words they refer to by index referred to by their ids
+  (short and long names) and names instead, so that they can be
+  compared across payloads.
+  """
+  words = payload["words"]
+  effects = payload["effects"]
+  names = [word["name"] for word in words]
+  stable = {}
+  for word in words:
+    word = dict(word)
+    word["erefs"] = [
+      [effects[effect_index]["short"], effects[effect_index]["long"], words[owner_index]["name"]]
+      for effect_index, owner_index in word["erefs"]
+    ]
+    word["outbound"] = [names[n] for n in word["outbound"]]
+    if "html" in word:
+      word["html"] = unlink_html(word["html"], names)
+    stable[word["name"]] = word
+  return stable
+
+
+def stable_effects(payload):
+  """Same as `stable_words`, but for effects of `payload`."""
+  words = payload["words"]
+  stable = {}
+  for effect in payload["effects"]:
+    effect = dict(effect)
+    effect["words"] = [words[n]["name"] for n in effect["words"]]
+    stable[effect["short"], effect["long"]] = effect
+  return stable
+
+
+def index_runs(indices):
+  """
+  Compress a list of `indices` into runs: pairs of the first index
+  and the length of each run of consecutive indices, with -1 in
+  place of the first index for runs of -1s.
+  """
+  runs = []
+  for index in indices:
+    if runs and (runs[-1][0] == index == -1 or index >= 0 and runs[-1][0] >= 0 and runs[-1][0] + runs[-1][1] == index):
+      runs[-1][1] += 1
+    else:
+      runs.append([index, 1])
+  return runs
+
+
+def expand_runs(runs):
+  """Undo `index_runs`."""
+  return [-1 if start < 0 else start + n for start, length in runs for n in range(length)]
+
+
+def delta_payload(previous, payload, indices=False):
+  """
+  Return a delta that turns `previous` payload into `payload`.
+
+  Words are identified across payloads by their names, and effects
+  by their ids; a word or effect is unchanged if it is the same
+  once the words and effects it refers to are identified that way.
+  Words and effects are copied from `previous` by its indices,
+  listed in runs (see `index_runs`) with -1 for added ones, and
+  have the indices they refer to (including in links in HTML)
+  remapped accordingly. Added and changed ones are then given in
+  full, under "added" and "changed" with their new index. "removed"
+  lists indices of words and effects of `previous` that are gone.
+
+  Indices (see `index_payload`) are left out unless `indices` is
+  true, as they refer to words by index, and so change all over
+  with most edits. If included, those that changed are given in
+  full, by kind and by their top-level field (e.g. "names" of
+  "search").
+  """
+  delta = {
+    "format": "delta",
+    "base": payload_digest(previous),
+    "digest": payload_digest(payload),
+  }
+  for key, stable in (("words", stable_words), ("effects", stable_effects)):
+    old = stable(previous)
+    new = stable(payload)
+    old_index = {id: index for index, id in enumerate(old)}
+    copied = []
+    added = []
+    changed = []
+    for index, (id, item) in enumerate(new.items()):
+      if id not in old:
+        added.append([index, payload[key][index]])
+        copied.append(-1)
         continue
-      if pivot_short != old_eref["short"] or pivot_long != old_eref["long"]:
-        # It's not about the pivot effect. Not gonna touch it.
-        new_erefs.append(old_eref)
+      if old[id] != item:
+        changed.append([index, payload[key][index]])
+      copied.append(old_index[id])
+    delta[key] = {
+      "map": index_runs(copied),
+      "added": added,
+      "changed": changed,
+      "removed": [old_index[id] for id in old if id not in new],
+    }
+  if not indices:
+    return delta
+  old_index = previous.get("index", {})
+  new_index = payload.get("index", {})
+  delta["index"] = {}
+  for kind, index in new_index.items():
+    old = old_index.get(kind, {})
+    fields = {field: value for field, value in index.items() if old.get(field) != value}
+    if fields:
+      delta["index"][kind] = fields
+  delta["index_kinds"] = list(new_index)
+  return delta
+
+
+def apply_delta(previous, delta):
+  """
+  Apply `delta` (see `delta_payload`) to `previous` payload, and
+  return the resulting payload, without indices unless `delta`
+  has them. Raises ValueError if `delta` isn't for it.
+  """
+  if delta["base"] != payload_digest(previous):
+    raise ValueError('delta is for a different payload')
+  word_map, effect_map = (
+    {old: new for new, old in enumerate(expand_runs(delta[key]["map"])) if old >= 0}
+    for key in ("words", "effects")
+  )
+  words = dict(delta["words"]["added"] + delta["words"]["changed"])
+  effects = dict(delta["effects"]["added"] + delta["effects"]["changed"])
+  # Copy unchanged words and effects, and remap what they refer to.
+  for old, new in word_map.items():
+    if new not in words:
+      word = words[new] = dict(previous["words"][old])
+      word["erefs"] = [[effect_map[effect_index], word_map[owner_index]] for effect_index, owner_index in word["erefs"]]
+      word["outbound"] = [word_map[n] for n in word["outbound"]]
+      if "html" in word:
+        word["html"] = RE_HTML_LINK_INDEX.sub(lambda match: str(word_map[int(match[0])]), word["html"])
+  for old, new in effect_map.items():
+    if new not in effects:
+      effect = effects[new] = dict(previous["effects"][old])
+      effect["words"] = [word_map[n] for n in effect["words"]]
+  words = [words[index] for index in range(len(words))]
+  effects = [effects[index] for index in range(len(effects))]
+  payload = { "words": words, "effects": effects }
+  if delta.get("index_kinds"):
+    index = previous.get("index", {})
+    payload["index"] = {kind: {**index.get(kind, {}), **delta["index"].get(kind, {})} for kind in delta["index_kinds"]}
+  if payload_digest(payload) != delta["digest"]:
+    raise ValueError('delta did not apply cleanly')
+  return payload
+
+
+def build(words, cache=None, jobs=1, rewritten=None, html=False):
+  """
+  Build the payload for `words`, a dict of word JSON objects
+  keyed by their names. `rewritten` may list words that were
+  already rewritten up to the first barrier, in the same order,
+  with None for those that weren't (see `stream`). HTML of words
+  is included if `html` is true.
+
+  Return a tuple of the payload and its build info: what `rebuild`
+  needs to rebuild the payload next time. The latter isn't meant
+  to be shipped along with the payload.
+  """
+  # Form an array of WordObject instances from the words JSON.
+  # The architecture is a rewriting one, so we have to start from
+  # somewhere -- and here we start from WordObject-s.
+
+  generation = [WordObject(word) for word in words.values()]
+  names = list(words)
+  ready = set()
+  if rewritten:
+    for index, rewritable in enumerate(rewritten):
+      if rewritable is not None:
+        generation[index] = rewritable
+        ready.add(index)
+
+  # Begin rewriting. From this point onwards, nodes themselves decide what
+  # they're going to be. We're only giving them a "world" to live in and
+  # advancing this world until everything comes at a standstill.
+
+  if cache:
+    # Words found in the cache skip straight to the first barrier.
+    # Others are rewritten up to it, and then cached.
+    known = frozenset(names)
+    keys = [cache.key(word, known) for word in words.values()]
+    misses = []
+    for index, key in enumerate(keys):
+      if index in ready:
         continue
-      new_erefs.append([pivot_index, word_to_index[old_eref["owner"]]])
-    word["erefs"] = new_erefs
+      if cached := cache.get(key):
+        generation[index] = cached
+      else:
+        misses.append(index)
+    rewrite(generation, names, jobs, stop_at_barrier=True)
+    for index in misses:
+      cache.put(keys[index], generation[index])
+
+  world = rewrite(generation, names, jobs)
+
+  # Convert the rewritten generation to compact-ish JSON. Also
+  # remember what we need to rebuild the payload incrementally
+  # next time (see `rebuild`).
+
+  with STATS.stage('to_payload', len(generation)):
+    same_as = same_as_of(generation)
+    payload = to_payload(generation, html)
+  build_info = {
+    "digests": [digest(word) for word in words.values()],
+    "neighbors": [[index, merge_ranges(reads)] for index, reads in sorted(world.reads.items())],
+    "same_as": same_as
+  }
+  return payload, build_info
 
 
-if progress:
-  print('[DONE] Rewriting done. STDOUT is a TTY, printing...')
+def rebuild(previous, old_build, words, cache=None, jobs=1, html=False):
+  """
+  Rebuild `previous` payload, with its build info `old_build`, for
+  `words` (see `build`) by only rewriting words that could have
+  changed since. `cache` and `jobs` are as in `build`. Return a
+  tuple of the new payload and its build info, or None if `previous`
+  can't be rebuilt, e.g. because words were added, removed or
+  reordered, or because it has no HTML of words and `html` is true.
+  """
+  old_words = previous["words"]
+  old_effects = previous["effects"]
+  names = list(words)
+  objects = list(words.values())
+  if [word["name"] for word in old_words] != names:
+    return None
+  if html and not all("html" in word for word in old_words):
+    return None
+  digests = [digest(obj) for obj in objects]
+  changed = {index for index, (new, old) in enumerate(zip(digests, old_build["digests"])) if new != old}
+  neighbors = dict(old_build["neighbors"])
+  same_as = {index: set(targets) for index, targets in old_build["same_as"]}
+  # A word is affected if it changed, or if it looked at (by outbound
+  # ref or as a neighbor) an affected word. At the barrier, words see
+  # words to their left already rewritten, and words to their right
+  # as they were before. So the latter only matter if they changed.
+  # Words are affected in order, so both lists stay sorted.
+  changed_in_order = sorted(changed)
+  affected_in_order = []
+  def _reads(index):
+    return [*neighbors.get(index, ()), *([n, n + 1] for n in old_words[index]["outbound"])]
+  def _any_within(indices, begin, end):
+    return bisect.bisect_left(indices, begin) < bisect.bisect_left(indices, end)
+  for index in range(len(old_words)):
+    if index in changed or any(
+      _any_within(changed_in_order, begin, end) or _any_within(affected_in_order, begin, min(end, index))
+      for begin, end in _reads(index)
+    ):
+      affected_in_order.append(index)
+  affected = set(affected_in_order)
+  # Work out which words the replay is going to need: affected words,
+  # words they read, and, since words to the left of a word crossing
+  # the barrier have to cross it too (see `replay`), words those read.
+  # The latter are predicted from what they read last time.
+  np = lazy('numpy')
+  needed = np.zeros(len(names), dtype=bool)
+  crossing = np.zeros(len(names), dtype=bool)
+  crossing[affected_in_order] = True
+  pending = list(affected_in_order)
+  while pending:
+    index = pending.pop()
+    needed[index] = True
+    for begin, end in _reads(index):
+      needed[begin:end] = True
+      left = np.flatnonzero(~crossing[begin:min(end, index)]) + begin
+      crossing[left] = True
+      pending.extend(left.tolist())
+  # Rewrite the needed words up to the barrier all at once, unless they
+  # are cached. Should the replay need any others, they are rewritten
+  # (or fetched from the cache) one at a time.
+  known = frozenset(names)
+  bases = {}
+  def _rewrite_to_barrier(indices):
+    generation = [WordObject(objects[index]) for index in indices]
+    rewrite(generation, [names[index] for index in indices], jobs, known=known, stop_at_barrier=True)
+    for index, rewritable in zip(indices, generation):
+      bases[index] = pickle.dumps(rewritable, pickle.HIGHEST_PROTOCOL)
+      if cache:
+        cache.put(cache.key(objects[index], known), rewritable)
+  def _cached(n):
+    if cache and (cached := cache.get(cache.key(objects[n], known))):
+      bases[n] = pickle.dumps(cached, pickle.HIGHEST_PROTOCOL)
+      return True
+    return False
+  def _base(n):
+    if n not in bases and not _cached(n):
+      _rewrite_to_barrier([n])
+    return pickle.loads(bases[n])
+  _rewrite_to_barrier([n for n in np.flatnonzero(needed).tolist() if not _cached(n)])
+  # Members of the world are materialized on demand, see `replay`.
+  world = World([None] * len(names), names, known)
+  rewritten = replay(world, sorted(affected), _base)
+  generation = [rewritten[index] for index in sorted(affected)]
+  rewrite(generation, [names[index] for index in sorted(affected)], known=known)
+  new_words = dict(zip(sorted(affected), generation))
+  # Splice rewritten words into the old ones, which we convert
+  # back to their fully rewritten form.
+  words = []
+  for index, word in enumerate(old_words):
+    if index in new_words:
+      words.append(new_words[index])
+      continue
+    word = dict(word)
+    word["erefs"] = [
+      {
+        "short": old_effects[effect_index]["short"],
+        "long": old_effects[effect_index]["long"],
+        "owner": names[owner_index]
+      }
+      for effect_index, owner_index in word["erefs"]
+    ]
+    word["outbound"] = [{"name": names[n], "same-as": n in same_as.get(index, ())} for n in word["outbound"]]
+    word["html"] = unlink_html(word["html"], names) if html else None
+    words.append(word)
+  for index in rewritten:
+    neighbors.pop(index, None)
+  neighbors.update(world.reads)
+  same_as = same_as_of(words)
+  payload = to_payload(words, html)
+  build_info = {
+    "digests": digests,
+    "neighbors": [[index, merge_ranges(reads)] for index, reads in sorted(neighbors.items())],
+    "same_as": same_as
+  }
+  return payload, build_info
+
+
+def read_words(lines, cache=None, jobs=1, rewrite=True):
+  """
+  Read word JSON objects from `lines`: either one JSON object
+  with all words under "words", or newline-delimited JSON with
+  one word object per line. In the latter case, unless `rewrite`
+  is false, words are also rewritten as they arrive (see `stream`).
+
+  Return a tuple of the words dict (see `build`) and the list of
+  words rewritten so far, or None.
+  """
+  lines = iter(lines)
+  first = next(lines, '')
+  try:
+    record = json.loads(first)
+  except json.JSONDecodeError:
+    record = None
+  if not isinstance(record, dict) or "words" in record:
+    words = json.loads(first + ''.join(lines))["words"]
+    for obj in words.values() if isinstance(words, dict) else words:
+      checked_word(obj)
+    return words, None
+  if not rewrite:
+    return {obj["name"]: obj for obj in records(itertools.chain([first], lines))}, None
+  return stream(itertools.chain([first], lines), cache, jobs)
+
+
+def build_payload(words, cache=None, jobs=1, rewritten=None, indices=(), html=False):
+  """
+  Build and return the docs payload for `words`, word JSON objects
+  with "name" and "desc", either in a dict keyed by their names
+  or in a list. See `build_payload_with_info` for the arguments.
+  """
+  payload, _ = build_payload_with_info(words, cache, jobs, rewritten=rewritten, indices=indices, html=html)
+  return payload
+
+
+def build_payload_with_info(words, cache=None, jobs=1, previous=None, old_build=None, rewritten=None, indices=(), html=False):
+  """
+  Same as `build_payload`, but return a tuple of the payload and
+  its build info (see `build`).
+
+  `cache` is a `Cache` for results of per-word stages, and `jobs`
+  is the number of processes to run them on. If `previous` payload
+  and its build info `old_build` are given, it is rebuilt
+  incrementally if possible (see `rebuild`).
+  `rewritten` may list words already rewritten up to the first
+  barrier (see `stream`). `indices` lists kinds of indices to add
+  to the payload (see `index_payload`). If `html` is true, words
+  get pre-rendered HTML of their markdown (see `LinkingRenderer`).
+  """
+  if not isinstance(words, dict):
+    words = {obj["name"]: obj for obj in words}
+  built = None
+  if previous is not None and old_build is not None:
+    with TIMING('rebuild'):
+      built = rebuild(previous, old_build, words, cache, jobs, html)
+  if previous is not None and built is None:
+    print('[WARN] Cannot rebuild incrementally, building from scratch', file=sys.stderr)
+  if built is None:
+    with TIMING('build'):
+      built = build(words, cache, jobs, rewritten, html)
+  payload, build_info = built
+  with TIMING('index'):
+    index_payload(payload, build_info, indices)
+  return payload, build_info
+
+
+def warm_up():
+  """Import modules and load models that rewriting needs."""
+  lazy('numpy')
+  get_assoc_markdown()
+  get_sent_tokenizer()
+  get_word_tokenizer()
+  get_tagger()
+
+
+class PayloadRequestHandler(http.server.BaseHTTPRequestHandler):
+  """
+  Handles requests to the docs server (see `serve`). POST word
+  JSON, in any format `read_words` accepts, to get the payload.
+  """
+  def address_string(self):
+    # Clients of Unix sockets have no address.
+    return self.client_address[0] if self.client_address else 'unix'
+
+  def do_POST(self):
+    server = self.server
+    length = int(self.headers.get('Content-Length', 0))
+    # Metrics are per run, so the server would otherwise collect
+    # them forever.
+    STATS.reset()
+    try:
+      body = self.rfile.read(length).decode()
+      words, _ = read_words(io.StringIO(body), rewrite=False)
+      payload, build_info = build_payload_with_info(
+        words, server.cache, server.jobs, server.previous, server.build_info,
+        indices=server.indices, html=server.html
+      )
+    except (ValueError, KeyError, TypeError) as error:
+      self.send_error(400, f'Bad word JSON: {error}')
+      return
+    if server.cache:
+      server.cache.save()
+    # The last payload is remembered, so that the next one can
+    # be rebuilt from it incrementally.
+    server.previous = payload
+    server.build_info = build_info
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+
+class PayloadHTTPServer(http.server.HTTPServer):
+  """Docs server listening on a TCP socket, see `serve`."""
+
+
+class PayloadUnixServer(socketserver.UnixStreamServer):
+  """Docs server listening on a Unix socket, see `serve`."""
+
+
+def serve(address, cache=None, jobs=1, indices=(), html=False):
+  """
+  Serve docs payloads over HTTP on `address`, either `HOST:PORT`
+  or `unix:PATH` for a Unix socket, until interrupted.
+
+  The server keeps modules, models, sentence memos and its last
+  payload warm between requests, so regenerating the payload
+  after an edit takes a fraction of a full run.
+  """
+  if address.startswith('unix:'):
+    path = Path(address[len('unix:'):])
+    path.unlink(missing_ok=True)
+    server = PayloadUnixServer(str(path), PayloadRequestHandler)
+  else:
+    host, _, port = address.rpartition(':')
+    server = PayloadHTTPServer((host or 'localhost', int(port)), PayloadRequestHandler)
+  server.cache = cache
+  server.jobs = jobs
+  server.indices = indices
+  server.html = html
+  server.previous = None
+  server.build_info = None
+  warm_up()
+  global WORKER_POOL
+  if jobs > 1:
+    WORKER_POOL = ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(frozenset(), MODELS_SNAPSHOT))
+  print(f'[INFO] Serving docs payloads on {address}', file=sys.stderr)
+  with server:
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      if WORKER_POOL is not None:
+        WORKER_POOL.shutdown()
+        WORKER_POOL = None
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Read JSON documentation produced by json-docs.nk from STDIN (one object, or one object per word per line), and print the docs payload to STDOUT.'
+  )
+  parser.add_argument(
+    '-j', '--jobs', type=int, default=1, metavar='N',
+    help='run per-word stages (up to the first one that reads neighbors) on a pool of N processes'
+  )
+  parser.add_argument(
+    '--cache', metavar='DIR',
+    help='cache results of per-word stages in DIR, and reuse them for words that did not change'
+  )
+  parser.add_argument(
+    '--cache-max-size', type=int, default=256, metavar='MB',
+    help='evict least recently used cache entries above this size (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--cache-max-age', type=int, default=30, metavar='DAYS',
+    help='evict cache entries unused for this many days (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--incremental', metavar='PAYLOAD',
+    help='rebuild a previous PAYLOAD by only rewriting words that could have changed, using build info from --build-info. A word whose candidate names collide reads many of its neighbors, so editing it, or a word near it, can force much of the corpus to be rewritten'
+  )
+  parser.add_argument(
+    '--build-info', metavar='FILE',
+    help='write what --incremental needs to rebuild the payload next time to FILE, and with --incremental, read it from FILE first'
+  )
+  parser.add_argument(
+    '--delta', metavar='FILE',
+    help='with --incremental, also write a delta from the previous payload to the new one to FILE, for clients that have the previous one (without indices unless --delta-index)'
+  )
+  parser.add_argument(
+    '--delta-index', action='store_true',
+    help='with --delta, also put indices that changed in the delta, in full'
+  )
+  parser.add_argument(
+    '--index', action='append', choices=tuple(INDEXERS), default=[], metavar='KIND',
+    help=f'add an index of KIND to the payload, one of: {", ".join(INDEXERS)} (may be given more than once)'
+  )
+  parser.add_argument(
+    '--html', action='store_true',
+    help='add sanitized HTML of the markdown of each word to the payload, with code spans that name words linked to them by index'
+  )
+  parser.add_argument(
+    '--format', choices=('json', 'columnar'), default='json',
+    help='payload format: objects per word and effect, or a string table and columns (default: %(default)s)'
+  )
+  parser.add_argument(
+    '-o', '--output', metavar='FILE',
+    help='write the payload to FILE instead of STDOUT'
+  )
+  parser.add_argument(
+    '--precompress', action='store_true',
+    help='with --output or --shards (and --delta), also write .gz and .br (if brotli is installed) compressed files next to each file written'
+  )
+  parser.add_argument(
+    '--shards', metavar='DIR',
+    help='split the payload into shards, and write them with a manifest to DIR instead of STDOUT (--incremental accepts such DIR too)'
+  )
+  parser.add_argument(
+    '--shard-by', choices=('namespace', 'size'), default='namespace',
+    help='with --shards, put words of each namespace (e.g. "entry" of "entry:fetch") in their own shards, or just split words by --shard-size (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--shard-size', type=int, default=256, metavar='N',
+    help='with --shards, put at most N words in a shard, or any number if 0 (default: %(default)s)'
+  )
+  parser.add_argument(
+    '--serve', metavar='ADDRESS',
+    help='instead of reading STDIN, serve payloads over HTTP on ADDRESS (HOST:PORT, or unix:PATH for a Unix socket) for word JSON POSTed to it, keeping models and caches warm'
+  )
+  parser.add_argument(
+    '--timing', action='store_true',
+    help='report to STDERR how much time was spent importing modules, loading models, and in each phase of the run'
+  )
+  parser.add_argument(
+    '--stats', nargs='?', const='-', metavar='FILE',
+    help='write metrics of the run as JSON to FILE, or to STDERR if FILE is omitted: time spent and words rewritten per stage and per round, candidates and collisions, calls to regexes and NLTK, and how well the sentence memos did (all in this process, not in pool workers)'
+  )
+  parser.add_argument(
+    '--stats-tracemalloc', action='store_true',
+    help='with --stats, also trace memory allocations to report peak memory allocated per stage (slows the run down)'
+  )
+  parser.add_argument(
+    '--memo-size', type=int, default=MEMO_SIZE, metavar='N',
+    help='memoize tokens and tags of up to N recently seen sentences each (default: %(default)s)'
+  )
+  args = parser.parse_args()
+
+  if args.precompress and not (args.output or args.shards):
+    parser.error('--precompress requires --output or --shards')
+  if args.delta and not args.incremental:
+    parser.error('--delta requires --incremental')
+  if args.delta_index and not args.delta:
+    parser.error('--delta-index requires --delta')
+  if args.incremental and not args.build_info:
+    parser.error('--incremental requires --build-info')
+  if args.shards and (args.output or args.format != 'json'):
+    parser.error('--shards cannot be used with --output or --format')
+
+  global MODELS_SNAPSHOT
+
+  SENTENCE_TOKENS.size = SENTENCE_TAGS.size = args.memo_size
+
+  if args.stats:
+    count_regex_calls()
+    if args.stats_tracemalloc:
+      tracemalloc.start()
+      STATS.tracemalloc = True
+
+  cache = None
+  if args.cache:
+    cache = Cache(args.cache, args.cache_max_size * 2**20, args.cache_max_age * 24 * 3600)
+    MODELS_SNAPSHOT = Path(args.cache) / 'models.marshal'
+
+  if args.serve:
+    serve(args.serve, cache, args.jobs, args.index, args.html)
+    if cache:
+      cache.close()
+    return
+
+  with TIMING('read input'):
+    words, rewritten = read_words(sys.stdin, cache, args.jobs, rewrite=not args.incremental)
+
+  previous = None
+  if args.incremental and Path(args.incremental).is_dir():
+    previous = read_shards(args.incremental)
+  elif args.incremental:
+    with open(args.incremental) as file:
+      previous = json.load(file)
+    if previous.get("format") == "columnar":
+      previous = from_columnar(previous)
+
+  old_build = None
+  if args.incremental and Path(args.build_info).exists():
+    with open(args.build_info) as file:
+      old_build = json.load(file)
+    # The file could have been written since by a build of another
+    # payload.
+    if old_build.pop("payload") != payload_digest(previous):
+      print(f'[WARN] Build info in {args.build_info} is not for {args.incremental}', file=sys.stderr)
+      old_build = None
+
+  payload, build_info = build_payload_with_info(words, cache, args.jobs, previous, old_build, rewritten, args.index, args.html)
+
+  if cache:
+    cache.close()
+
+  with TIMING('write output'):
+    if args.shards:
+      write_shards(args.shards, payload, args.shard_by, args.shard_size, args.precompress)
+    elif args.output:
+      output = encode_payload(payload, args.format)
+      Path(args.output).write_text(output)
+      if args.precompress:
+        precompress(args.output, output.encode())
+    else:
+      print(encode_payload(payload, args.format))
+    if args.delta:
+      delta = json.dumps(delta_payload(previous, payload, args.delta_index), separators=(',', ':'))
+      Path(args.delta).write_text(delta)
+      if args.precompress:
+        precompress(args.delta, delta.encode())
+    if args.build_info:
+      build_info = { "payload": payload_digest(payload), **build_info }
+      Path(args.build_info).write_text(json.dumps(build_info, separators=(',', ':')))
+
+  if args.timing:
+    TIMING.report()
+
+  if args.stats:
+    stats = STATS.to_dict()
+    stats["timing"] = TIMING.spans
+    stats["memos"] = {
+      label: { "size": memo.size, "hits": memo.hits, "misses": memo.misses, "evictions": memo.evictions }
+      for label, memo in (('sentence tokens', SENTENCE_TOKENS), ('sentence tags', SENTENCE_TAGS))
+    }
+    if args.stats == '-':
+      print(json.dumps(stats, indent=2), file=sys.stderr)
+    else:
+      with open(args.stats, 'w') as file:
+        json.dump(stats, file, indent=2)
 
 
-print(json.dumps({ "words": words, "effects": list(effects) }, separators=(',', ':')))
+if __name__ == '__main__':
+  main()